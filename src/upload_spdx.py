@@ -11,10 +11,27 @@ __author__ = 'Ted Gauthier'
 __email__ = 'tedg@cisco.com'
 __version__ = '1.0.0'
 import os
+import re
+import glob
+import uuid
+import bisect
+import socket
+import json
+import math
+import shlex
+import subprocess
+import random
+import hashlib
+import itertools
 import sys
 import time
+import shutil
 import argparse
 import logging
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed, wait, FIRST_COMPLETED
 import requests
 
 # Configure logging
@@ -23,6 +40,10 @@ logger = logging.getLogger('upload_spdx ')
 logger.setLevel(level=logging.INFO)
 
 MAX_REQ_TIMEOUT = 120    # requests default timeout = 120 seconds
+MAX_BENCH_SECONDS = 600  # longest a pooled service account is benched
+# a lease is held across a GET and a create POST, each up to 3 attempts of MAX_REQ_TIMEOUT
+# with 1 + 2 + 4 seconds of backoff, after waiting up to MAX_BENCH_SECONDS for an account
+LEASE_TTL = 2 * (3 * MAX_REQ_TIMEOUT + 1 + 2 + 4) + MAX_BENCH_SECONDS
 
 
 class CoronaConfig:
@@ -71,8 +92,60 @@ class CoronaConfig:
 
     @staticmethod
     def get_spdx_file_path():
-        # return os.getenv('CORONA_PRODUCT_NAME', 'your_spdx_file_path_here')
-        return os.getenv('CORONA_PRODUCT_NAME', './bes-traceability-spdx.json')
+        # return os.getenv('CORONA_SPDX_FILE_PATH', 'your_spdx_file_path_here')
+        return os.getenv('CORONA_SPDX_FILE_PATH', './bes-traceability-spdx.json')
+
+    @staticmethod
+    def get_dedupe_packages():
+        ''' 'true' to de-duplicate SPDX packages (by purl/CPE/name+version) before upload '''
+        return os.getenv('CORONA_DEDUPE_PACKAGES', 'false').lower() == 'true'
+
+    @staticmethod
+    def get_input_format():
+        ''' SBOM format of the SPDX file: auto, spdx-json, spdx-tv or cyclonedx-json '''
+        return os.getenv('CORONA_INPUT_FORMAT', 'auto')
+
+    @staticmethod
+    def get_cache_dir():
+        ''' Directory for the on-disk tier of the GET response cache; empty disables the disk tier '''
+        return os.getenv('CORONA_CACHE_DIR', '')
+
+    @staticmethod
+    def get_cache_entries():
+        ''' Number of GET responses kept in the in-memory cache tier; 0 disables response caching '''
+        return int(os.getenv('CORONA_CACHE_ENTRIES', '256'))
+
+    @staticmethod
+    def get_state_file():
+        ''' Where the ci command records the input fingerprints of the last successful uploads '''
+        return os.getenv('CORONA_STATE_FILE', './.corona_upload_state.json')
+
+    @staticmethod
+    def get_credentials_file():
+        ''' JSON list of service accounts, [{"username": ..., "pat": ..., "host": ... (optional)}], to spread requests over '''
+        return os.getenv('CORONA_CREDENTIALS_FILE', '')
+
+    # NOTE: The config items below are for uploading the same SPDX file to several Corona hosts
+
+    @staticmethod
+    def get_targets():
+        ''' Comma-separated list of Corona hosts, e.g., 'corona-stage.cisco.com,corona.cisco.com' '''
+        targets = os.getenv('CORONA_TARGETS', '')
+        return [host.strip() for host in targets.split(',') if host.strip()]
+
+    @staticmethod
+    def _target_env_key(host):
+        return re.sub(r'[^A-Z0-9]', '_', host.upper())
+
+    @staticmethod
+    def get_target_user_name(host):
+        ''' CORONA_USERNAME_<HOST>, e.g., CORONA_USERNAME_CORONA_STAGE_CISCO_COM; defaults to CORONA_USERNAME '''
+        return os.getenv(f'CORONA_USERNAME_{CoronaConfig._target_env_key(host)}', CoronaConfig.get_user_name())
+
+    @staticmethod
+    def get_target_pat(host):
+        ''' CORONA_PAT_<HOST>, e.g., CORONA_PAT_CORONA_STAGE_CISCO_COM; defaults to CORONA_PAT '''
+        return os.getenv(f'CORONA_PAT_{CoronaConfig._target_env_key(host)}', CoronaConfig.get_corona_pat())
 
 
 class CoronaError(Exception):
@@ -81,45 +154,296 @@ class CoronaError(Exception):
 
 
 
+class ResponseCache:
+    '''
+        Cache of GET responses with an in-memory LRU tier and an optional on-disk tier.
+
+        Only responses carrying an ETag or Last-Modified validator are stored; a cached entry is
+        never served without revalidation, make_authenticated_request() sends If-None-Match /
+        If-Modified-Since and reuses the cached body on 304 Not Modified. Entries are grouped
+        by (host, resource), e.g., ('corona.cisco.com', 'releases'), so that a write to a
+        resource invalidates its listings; writes to a sub-resource, e.g., an image's spdx.json,
+        leave them in place.
+    '''
+
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    @classmethod
+    def from_config(cls):
+        ''' ResponseCache configured by CORONA_CACHE_ENTRIES / CORONA_CACHE_DIR, or None when disabled '''
+        max_entries = CoronaConfig.get_cache_entries()
+        if max_entries <= 0:
+            return None
+        return cls(max_entries, CoronaConfig.get_cache_dir() or None)
+
+    @staticmethod
+    def resource_of(endpoint):
+        ''' Resource name of an endpoint, e.g., 'api/v2/releases?product_id=1' -> 'releases' '''
+        parts = endpoint.split('?')[0].strip('/').split('/')
+        if len(parts) >= 3 and parts[0] == 'api':
+            return parts[2]
+        return parts[0]
+
+    @staticmethod
+    def is_sub_resource(endpoint):
+        ''' True for endpoints below a resource item, e.g., 'api/v2/images/1/spdx.json' '''
+        parts = endpoint.split('?')[0].strip('/').split('/')
+        return len(parts) > (4 if parts[0] == 'api' else 2)
+
+    @staticmethod
+    def _group(host, resource):
+        return hashlib.sha256(f'{host}/{resource}'.encode('utf-8')).hexdigest()[:16]
+
+    def _path(self, group, url):
+        return os.path.join(self.cache_dir, f"{group}-{hashlib.sha256(url.encode('utf-8')).hexdigest()}.json")
+
+    def get(self, host, endpoint, url):
+        ''' Cached entry {'etag', 'last_modified', 'body'} for url, or None '''
+        with self._lock:
+            cached = self._entries.get(url)
+            if cached is not None:
+                self._entries.move_to_end(url)
+                return cached[1]
+        if not self.cache_dir:
+            return None
+        group = self._group(host, self.resource_of(endpoint))
+        try:
+            with open(self._path(group, url), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        self._remember(group, url, entry)
+        return entry
+
+    def store(self, host, endpoint, url, response_headers, body):
+        ''' Store body for url if the response carries an ETag or Last-Modified validator '''
+        etag = response_headers.get('ETag')
+        last_modified = response_headers.get('Last-Modified')
+        if not etag and not last_modified:
+            return
+        entry = {'etag': etag, 'last_modified': last_modified, 'body': body}
+        group = self._group(host, self.resource_of(endpoint))
+        self._remember(group, url, entry)
+        if self.cache_dir:
+            path = self._path(group, url)
+            tmp_path = None
+            try:
+                # unique per process and thread: nodes may share one CORONA_CACHE_DIR
+                fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entry, f)
+                os.replace(tmp_path, path)
+            except OSError as e:
+                msg = f"Unable to write response cache entry '{path}': {e}"
+                logger.warning(msg)
+                if tmp_path:
+                    try:
+                        os.remove(tmp_path)
+                    except OSError:
+                        pass
+
+    def invalidate(self, host, endpoint):
+        ''' Drop every cached listing of the resource that endpoint writes to, unless it is a sub-resource '''
+        if self.is_sub_resource(endpoint):
+            return
+        group = self._group(host, self.resource_of(endpoint))
+        with self._lock:
+            for url in [url for url, cached in self._entries.items() if cached[0] == group]:
+                del self._entries[url]
+        if self.cache_dir:
+            for file_name in os.listdir(self.cache_dir):
+                if file_name.startswith(f'{group}-'):
+                    try:
+                        os.remove(os.path.join(self.cache_dir, file_name))
+                    except OSError:
+                        pass
+
+    def _remember(self, group, url, entry):
+        with self._lock:
+            self._entries[url] = (group, entry)
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class ServiceAccount:
+    '''One Corona service account of a CredentialPool, with its own token and load/throttle state.'''
+
+    def __init__(self, user_name, pat, max_in_flight=None, rate_per_second=None):
+        self.user_name = user_name
+        self.pat = pat
+        self.max_in_flight = max_in_flight
+        self.rate_per_second = rate_per_second
+        self.token = None
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0           # consecutive throttles/auth failures
+        self.benched_until = 0.0    # out of rotation until this time.monotonic()
+        self.next_allowed = 0.0     # earliest time.monotonic() of the next request under rate_per_second
+        self.sign_in_lock = threading.Lock()
+
+    def __repr__(self):
+        return f"ServiceAccount('{self.user_name}')"
+
+
+class CredentialPool:
+    '''
+        Spread requests over several Corona service accounts.
+
+        acquire() leases the least loaded account (fewest requests in flight, then fewest
+        requests overall) that is in rotation and within its own max_in_flight/rate_per_second
+        limits, waiting if there is none. An account whose request is throttled (429) or whose
+        authentication fails (401 or sign-in error) is taken out of rotation for bench_seconds,
+        doubling on each consecutive failure up to max_bench_seconds; an auth failure also drops
+        its token so it signs in again when it returns.
+    '''
+
+    def __init__(self, accounts, bench_seconds=30, max_bench_seconds=MAX_BENCH_SECONDS):
+        if not accounts:
+            raise CoronaError('A credential pool needs at least one service account.')
+        self.accounts = accounts
+        self.bench_seconds = bench_seconds
+        self.max_bench_seconds = max_bench_seconds
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_file(cls, credentials_file, host=None):
+        ''' CredentialPool of the accounts in credentials_file that apply to host (entries without a host apply to all) '''
+        try:
+            with open(credentials_file, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            raise CoronaError(f"Credentials file '{credentials_file}' not found.")
+        except ValueError as e:
+            raise CoronaError(f"Credentials file '{credentials_file}' is not valid JSON: {e}") from e
+        try:
+            accounts = [ServiceAccount(entry['username'], entry['pat'], entry.get('max_in_flight'), entry.get('rate_per_second')) 
+                        for entry in entries if host is None or entry.get('host', host) == host]
+        except (KeyError, TypeError) as e:
+            raise CoronaError(f"Credentials file '{credentials_file}' entries need username and pat: {e}") from e
+        return cls(accounts)
+
+    @classmethod
+    def from_config(cls, host):
+        ''' CredentialPool for host from CORONA_CREDENTIALS_FILE, or None when not configured '''
+        credentials_file = CoronaConfig.get_credentials_file()
+        return cls.from_file(credentials_file, host) if credentials_file else None
+
+    def _available(self, account, now):
+        if account.benched_until > now or account.next_allowed > now:
+            return False
+        return account.max_in_flight is None or account.in_flight < account.max_in_flight
+
+    def acquire(self):
+        ''' Lease the least loaded account in rotation; pass it to release() when the request is done '''
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                available = [account for account in self.accounts if self._available(account, now)]
+                if available:
+                    account = min(available, key=lambda account: (account.in_flight, account.requests))
+                    account.in_flight += 1
+                    account.requests += 1
+                    if account.rate_per_second:
+                        account.next_allowed = now + 1.0 / account.rate_per_second
+                    return account
+                wake_ups = [max(account.benched_until, account.next_allowed) for account in self.accounts 
+                            if max(account.benched_until, account.next_allowed) > now]
+                self._condition.wait(min(wake_ups) - now if wake_ups else None)
+
+    def release(self, account, outcome='ok'):
+        '''
+            Return a leased account.
+
+            Args:
+                outcome: 'ok', 'throttled' (429) or 'unauthorized' (401 or sign-in failure)
+        '''
+        with self._condition:
+            account.in_flight -= 1
+            if outcome == 'ok':
+                account.failures = 0
+            else:
+                account.failures += 1
+                bench = min(self.bench_seconds * 2 ** (account.failures - 1), self.max_bench_seconds)
+                account.benched_until = time.monotonic() + bench
+                if outcome == 'unauthorized':
+                    account.token = None
+                msg = f"Account '{account.user_name}' {outcome}, out of rotation for {bench:.0f}s"
+                logger.warning(msg)
+            self._condition.notify_all()
+
+    def token_for(self, account, sign_in):
+        ''' account's token, signing in with sign_in(user_name, pat) the first time '''
+        with account.sign_in_lock:
+            if not account.token:
+                account.token = sign_in(account.user_name, account.pat)
+            return account.token
+
+
 class CoronaAPIClient:
     
-    def __init__(self, host, user_name):
+    def __init__(self, host, user_name, pat=None, response_cache=None, session=None, credential_pool=None):
         self.host = host
         self.user_name = user_name
         self.token = None
-        self.pat = None
+        self.pat = pat
+        self.response_cache = response_cache
+        self.session = session
+        self.credential_pool = credential_pool
+        self.throttled_requests = 0
+
+    @property
+    def _http(self):
+        ''' The requests.Session shared with other clients, if any, else the requests module '''
+        return self.session if self.session is not None else requests
+
+    @property
+    def base_url(self):
+        ''' https://<host>, unless host already carries a scheme, e.g., http://localhost:8080 for a stand-in server '''
+        return self.host.rstrip('/') if '://' in self.host else f'https://{self.host}'
 
     def get_auth_token(self):
         ''' Get Bearer token using the PAT (Personal Access Token) '''
         if not self.token:
-            try:
-                # Corona PAT (Personal Access Token for self.user_name)
+            # Corona PAT (Personal Access Token for self.user_name)
+            if not self.pat:
                 self.pat = CoronaConfig.get_corona_pat()
-                # msg = (f"Corona PAT : {self.pat}"); logger.debug(msg)
-
-                pat_header = {
-                    'user': {
-                        'username': self.user_name,
-                        'pat': self.pat
-                    }
-                }
-                msg = (f'>>>TEST>>> sign_in, pat_header = {pat_header}/n')
-                logger.debug(msg)
-                sign_in_res = requests.post(f'https://{self.host}/api/auth/sign_in', json=pat_header)
-                sign_in_res.raise_for_status()
-                self.token = sign_in_res.json().get('token')
-                msg = (f'>>>TEST>>> sign_in, pat_header = {pat_header}, API token = {self.token}/n')
-                logger.debug(msg)
-                if not self.token:
-                    raise CoronaError('Failed to retrieve token from response.')
-            except requests.exceptions.RequestException as e:
-                raise CoronaError(f'Error obtaining auth token: {e}') from e
-            except Exception as e:
-                raise CoronaError(f'Error: {e}') from e
+            # msg = (f"Corona PAT : {self.pat}"); logger.debug(msg)
+            self.token = self._sign_in(self.user_name, self.pat)
                 
         return self.token
 
-    def make_authenticated_request(self, method, endpoint, data=None, files=None, retries=3):
+    def _sign_in(self, user_name, pat):
+        ''' Sign in user_name with its PAT and return the Bearer token '''
+        try:
+            pat_header = {
+                'user': {
+                    'username': user_name,
+                    'pat': pat
+                }
+            }
+            msg = (f'>>>TEST>>> sign_in, pat_header = {pat_header}/n')
+            logger.debug(msg)
+            sign_in_res = self._http.post(f'{self.base_url}/api/auth/sign_in', json=pat_header)
+            sign_in_res.raise_for_status()
+            token = sign_in_res.json().get('token')
+            msg = (f'>>>TEST>>> sign_in, pat_header = {pat_header}, API token = {token}/n')
+            logger.debug(msg)
+            if not token:
+                raise CoronaError('Failed to retrieve token from response.')
+            return token
+        except requests.exceptions.RequestException as e:
+            raise CoronaError(f'Error obtaining auth token: {e}') from e
+        except Exception as e:
+            raise CoronaError(f'Error: {e}') from e
+
+    def make_authenticated_request(self, method, endpoint, data=None, files=None, retries=3, body=None):
         '''
             Helper function to make authenticated API requests with retry on failure.
 
@@ -128,29 +452,83 @@ class CoronaAPIClient:
                 method: API method (GET or POST)
                 endpoint: API endpoint being invoked
                 data: JSON data, defaults to None
+                body: instead of data/files, a callable returning (content_type, iterable of bytes);
+                      it is called again on each retry and the body is sent chunked, never held in memory
 
             Returns:
                 API request response converted to JSON
+
+            With a response_cache, GETs are revalidated against the cached ETag/Last-Modified
+            and other methods invalidate the cached listings of the resource they write to.
+
+            With a credential_pool, each attempt leases the least loaded service account; a
+            throttled or unauthorized attempt benches that account and retries with another.
         '''
-        self.get_auth_token()
+        if self.credential_pool is None:
+            self.get_auth_token()
         headers = {'Authorization': f'Bearer {self.token}'}
-        url = f'https://{self.host}/{endpoint}'
+        url = f'{self.base_url}/{endpoint}'
+
+        cache_entry = None
+        if self.response_cache is not None:
+            if method == 'GET':
+                cache_entry = self.response_cache.get(self.host, endpoint, url)
+                if cache_entry and cache_entry.get('etag'):
+                    headers['If-None-Match'] = cache_entry['etag']
+                if cache_entry and cache_entry.get('last_modified'):
+                    headers['If-Modified-Since'] = cache_entry['last_modified']
+            else:
+                self.response_cache.invalidate(self.host, endpoint)
 
         for attempt in range(retries):
+            account = None
+            outcome = 'ok'
+            if self.credential_pool is not None:
+                account = self.credential_pool.acquire()
+                try:
+                    headers['Authorization'] = f'Bearer {self.credential_pool.token_for(account, self._sign_in)}'
+                except CoronaError as e:
+                    self.credential_pool.release(account, 'unauthorized')
+                    msg = f"Sign-in of account '{account.user_name}' failed: {e}. Retrying... ({attempt + 1}/{retries})"
+                    logger.warning(msg)
+                    continue
             try:
                 msg = (f'>>>TEST>>> headers = {headers}, url = {url}/n')
                 logger.debug(msg)
-                response = requests.request(method, 
-                                            url, 
-                                            headers=headers, 
-                                            json=data, 
-                                            files=files,
-                                            timeout=MAX_REQ_TIMEOUT)
+                if body is not None:
+                    content_type, payload = body()
+                    response = self._http.request(method, 
+                                                  url, 
+                                                  headers=dict(headers, **{'Content-Type': content_type}), 
+                                                  data=payload, 
+                                                  timeout=MAX_REQ_TIMEOUT)
+                else:
+                    response = self._http.request(method, 
+                                                  url, 
+                                                  headers=headers, 
+                                                  json=data, 
+                                                  files=files,
+                                                  timeout=MAX_REQ_TIMEOUT)
                 response.raise_for_status()
-                return response.json()
+                if cache_entry is not None and response.status_code == 304:
+                    msg = f"'{endpoint}' not modified, using cached response"
+                    logger.debug(msg)
+                    return cache_entry['body']
+                res_json = response.json()
+                if self.response_cache is not None and method == 'GET':
+                    self.response_cache.store(self.host, endpoint, url, response.headers, res_json)
+                return res_json
 
             except requests.exceptions.HTTPError as e:
-                if response.status_code in [429, 500, 502, 503, 504]:
+                if response.status_code == 429:
+                    self.throttled_requests += 1
+                    outcome = 'throttled'
+                if account is not None and response.status_code in [401, 429]:
+                    # the pool benches this account; the next attempt leases another one
+                    outcome = 'unauthorized' if response.status_code == 401 else outcome
+                    msg = f"Account '{account.user_name}' {outcome} ({response.status_code}). Retrying... ({attempt + 1}/{retries})"
+                    logger.warning(msg)
+                elif response.status_code in [429, 500, 502, 503, 504]:
                     msg = (f'Temporary server error ({response.status_code}).  ' \
                             'Retrying... ({attempt + 1}/{retries})')
                     logger.warning(msg)
@@ -164,6 +542,10 @@ class CoronaAPIClient:
                 logger.warning(msg)
                 time.sleep(2 ** attempt)
 
+            finally:
+                if account is not None:
+                    self.credential_pool.release(account, outcome)
+
         raise CoronaError(f'Failed to perform request to {endpoint} after {retries} attempts')
 
 
@@ -293,12 +675,634 @@ class ImageManager(CoronaAPIClient):
             raise CoronaError(f"Unexpected response structure while fetching image '{image_name}'")
 
 
+class SpdxDeduplicator:
+    '''
+        De-duplicate the packages of a parsed SPDX JSON document in place.
+
+        Packages are identified by purl, else CPE, else name+version. The first package seen
+        for an identity is kept and absorbs the externalRefs of its duplicates; relationships
+        and documentDescribes that point at a removed SPDXID are rewritten to the kept one.
+        The index holds an 8-byte digest per identity rather than the identity itself, so its
+        size stays small on documents with hundreds of thousands of packages.
+    '''
+
+    KEY_REFERENCE_TYPES = ('purl', 'cpe23Type', 'cpe22Type')
+
+    def __init__(self):
+        self.packages_removed = 0
+        self.relationships_removed = 0
+
+    @staticmethod
+    def _digest(key):
+        return hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+
+    @classmethod
+    def package_key(cls, package):
+        ''' Identity of a package: purl, else CPE, else name+version '''
+        refs = package.get('externalRefs') or []
+        for ref_type in cls.KEY_REFERENCE_TYPES:
+            for ref in refs:
+                if ref.get('referenceType') == ref_type and ref.get('referenceLocator'):
+                    return f"{ref_type}:{ref['referenceLocator']}"
+        return f"name:{package.get('name')}@{package.get('versionInfo')}"
+
+    @staticmethod
+    def _merge_external_refs(kept, duplicate):
+        refs = kept.setdefault('externalRefs', [])
+        seen = {(r.get('referenceCategory'), r.get('referenceType'), r.get('referenceLocator')) for r in refs}
+        for ref in duplicate.get('externalRefs') or []:
+            ref_key = (ref.get('referenceCategory'), ref.get('referenceType'), ref.get('referenceLocator'))
+            if ref_key not in seen:
+                seen.add(ref_key)
+                refs.append(ref)
+
+    def deduplicate(self, spdx_doc):
+        ''' De-duplicate spdx_doc['packages'] and rewrite references to removed SPDXIDs; returns spdx_doc '''
+        for key in ('packages', 'relationships'):
+            elements = spdx_doc.get(key) or []
+            if not (isinstance(elements, list) and all(isinstance(element, dict) for element in elements)):
+                raise CoronaError(f"SPDX '{key}' must be a list of objects to de-duplicate.")
+        packages = spdx_doc.get('packages') or []
+        index = {}      # identity digest -> position of the kept package
+        renamed = {}    # removed SPDXID -> kept SPDXID
+        kept_count = 0
+        for package in packages:
+            digest = self._digest(self.package_key(package))
+            position = index.get(digest)
+            if position is None:
+                index[digest] = kept_count
+                packages[kept_count] = package
+                kept_count += 1
+                continue
+            kept = packages[position]
+            self._merge_external_refs(kept, package)
+            if package.get('SPDXID') and package.get('SPDXID') != kept.get('SPDXID'):
+                renamed[package['SPDXID']] = kept.get('SPDXID')
+        self.packages_removed += len(packages) - kept_count
+        del packages[kept_count:]
+        del index
+
+        if 'documentDescribes' in spdx_doc:
+            described = []
+            for spdx_id in spdx_doc['documentDescribes']:
+                spdx_id = renamed.get(spdx_id, spdx_id)
+                if spdx_id not in described:
+                    described.append(spdx_id)
+            spdx_doc['documentDescribes'] = described
+
+        relationships = spdx_doc.get('relationships') or []
+        seen = set()
+        kept_count = 0
+        for relationship in relationships:
+            element = renamed.get(relationship.get('spdxElementId'), relationship.get('spdxElementId'))
+            related = renamed.get(relationship.get('relatedSpdxElement'), relationship.get('relatedSpdxElement'))
+            rel_type = relationship.get('relationshipType')
+            digest = self._digest(f'{element}\0{rel_type}\0{related}')
+            merged_into_self = element == related and relationship.get('spdxElementId') != relationship.get('relatedSpdxElement')
+            if digest in seen or merged_into_self:
+                continue
+            seen.add(digest)
+            relationship['spdxElementId'] = element
+            relationship['relatedSpdxElement'] = related
+            relationships[kept_count] = relationship
+            kept_count += 1
+        self.relationships_removed += len(relationships) - kept_count
+        del relationships[kept_count:]
+
+        msg = f"De-duplicated SPDX: removed {self.packages_removed} packages and {self.relationships_removed} relationships"
+        logger.info(msg)
+        return spdx_doc
+
+
+def load_spdx_json(content, spdx_file_path, validate=False):
+    ''' Parse SPDX JSON content; with validate, require a JSON object with an 'spdxVersion' '''
+    try:
+        spdx_doc = json.loads(content)
+    except ValueError as e:
+        raise CoronaError(f"SPDX file '{spdx_file_path}' is not valid JSON: {e}") from e
+    if validate and not (isinstance(spdx_doc, dict) and str(spdx_doc.get('spdxVersion', '')).startswith('SPDX-')):
+        raise CoronaError(f"SPDX file '{spdx_file_path}' is not an SPDX JSON document (no spdxVersion).")
+    if validate:
+        for key in ('packages', 'files', 'relationships'):
+            if not isinstance(spdx_doc.get(key, []), list):
+                raise CoronaError(f"SPDX file '{spdx_file_path}' is not an SPDX JSON document ('{key}' is not a list).")
+    return spdx_doc
+
+
+def slim_spdx(content, spdx_file_path, dedupe=False, validate=False):
+    '''
+        Parse SPDX JSON content and re-serialize it without whitespace.
+
+        Args:
+            content: SPDX JSON bytes read from spdx_file_path
+            spdx_file_path: used in error messages
+            dedupe: de-duplicate packages (see SpdxDeduplicator)
+            validate: require a JSON object with an 'spdxVersion'
+
+        Returns:
+            compact SPDX JSON bytes
+    '''
+    spdx_doc = load_spdx_json(content, spdx_file_path, validate)
+    if dedupe:
+        SpdxDeduplicator().deduplicate(spdx_doc)
+    return json.dumps(spdx_doc, separators=(',', ':')).encode('utf-8')
+
+
+class PreparedSpdx:
+    '''An SPDX document read once and held in memory, ready to upload to any number of hosts.'''
+
+    def __init__(self, file_name, content):
+        self.file_name = file_name
+        self.content = content
+        self.sha256 = hashlib.sha256(content).hexdigest()
+
+    @classmethod
+    def from_file(cls, spdx_file_path, dedupe=False, validate=False):
+        ''' Read spdx_file_path into a PreparedSpdx, optionally validating it and de-duplicating its packages '''
+        try:
+            with open(spdx_file_path, 'rb') as f:
+                content = f.read()
+        except FileNotFoundError:
+            raise CoronaError(f"SPDX file '{spdx_file_path}' not found.")
+        if dedupe:
+            content = slim_spdx(content, spdx_file_path, dedupe=True, validate=validate)
+        elif validate:
+            load_spdx_json(content, spdx_file_path, validate=True)
+        return cls(os.path.basename(spdx_file_path), content)
+
+    @property
+    def text(self):
+        return self.content.decode('utf-8')
+
+
+def _json_array_chunks(elements):
+    for count, element in enumerate(elements):
+        yield (',' if count else '') + json.dumps(element, separators=(',', ':'))
+
+
+def _json_document_chunks(header, packages, files, relationships):
+    '''
+        SPDX JSON document as str chunks: the header fields, then the packages, files and
+        relationships arrays. packages is an iterable; files and relationships are callables
+        returning iterables, called once the previous array is complete, so that each can be
+        another pass over the source instead of being held back in memory.
+    '''
+    header_json = json.dumps(header, separators=(',', ':'))
+    yield header_json[:-1] + (',' if header else '') + '"packages":['
+    yield from _json_array_chunks(packages)
+    yield '],"files":['
+    yield from _json_array_chunks(files())
+    yield '],"relationships":['
+    yield from _json_array_chunks(relationships())
+    yield ']}'
+
+
+class TagValueSpdxConverter:
+    '''
+        Convert an SPDX 2.x tag-value document to SPDX JSON incrementally.
+
+        Tag-value interleaves packages, files and relationships, so the document is parsed in
+        three passes, one per SPDX JSON array, and only one element is held at a time. Document
+        and creation info tags must precede the first package, file or relationship.
+    '''
+
+    DOCUMENT_TAGS = {'SPDXVersion': 'spdxVersion', 'DataLicense': 'dataLicense', 'DocumentName': 'name', 
+                     'DocumentNamespace': 'documentNamespace', 'DocumentComment': 'comment'}
+    CREATION_TAGS = {'Created': 'created', 'LicenseListVersion': 'licenseListVersion', 'CreatorComment': 'comment'}
+    PACKAGE_TAGS = {'PackageName': 'name', 'PackageVersion': 'versionInfo', 'PackageFileName': 'packageFileName', 
+                    'PackageSupplier': 'supplier', 'PackageOriginator': 'originator', 
+                    'PackageDownloadLocation': 'downloadLocation', 'PackageHomePage': 'homepage', 
+                    'PackageSourceInfo': 'sourceInfo', 'PackageLicenseConcluded': 'licenseConcluded', 
+                    'PackageLicenseDeclared': 'licenseDeclared', 'PackageLicenseComments': 'licenseComments', 
+                    'PackageCopyrightText': 'copyrightText', 'PackageSummary': 'summary', 
+                    'PackageDescription': 'description', 'PackageComment': 'comment', 
+                    'PrimaryPackagePurpose': 'primaryPackagePurpose'}
+    FILE_TAGS = {'FileName': 'fileName', 'LicenseConcluded': 'licenseConcluded', 'FileCopyrightText': 'copyrightText', 
+                 'FileComment': 'comment', 'LicenseComments': 'licenseComments', 'FileNotice': 'noticeText'}
+    ELEMENT_TAGS = ('PackageName', 'FileName', 'Relationship')
+    LIST_TAGS = {'LicenseInfoInFile': 'licenseInfoInFiles', 'PackageLicenseInfoFromFiles': 'licenseInfoFromFiles', 
+                 'FileType': 'fileTypes'}
+
+    def __init__(self, spdx_file_path):
+        self.spdx_file_path = spdx_file_path
+
+    def _iter_tags(self):
+        ''' (tag, value) pairs, with <text>...</text> values joined across lines '''
+        with open(self.spdx_file_path, 'r', encoding='utf-8') as f:
+            lines = iter(f)
+            for line in lines:
+                line = line.strip()
+                if not line or line.startswith('#') or ':' not in line:
+                    continue
+                tag, value = (part.strip() for part in line.split(':', 1))
+                if value.startswith('<text>'):
+                    text = [value[len('<text>'):]]
+                    while '</text>' not in text[-1]:
+                        text.append(next(lines, '</text>').rstrip('\n'))
+                    value = '\n'.join(text)
+                    value = value[:value.index('</text>')]
+                yield tag, value
+
+    def validate(self):
+        ''' Raise CoronaError unless an SPDXVersion tag precedes the first package, file or relationship '''
+        for tag, _ in self._iter_tags():
+            if tag == 'SPDXVersion':
+                return
+            if tag in self.ELEMENT_TAGS:
+                break
+        raise CoronaError(f"'{self.spdx_file_path}' is not an SPDX tag-value document: no SPDXVersion before the first element")
+
+    def _iter_elements(self, header):
+        ''' Parse the document, filling header before the first element; yields ('package' | 'file' | 'relationship', element) '''
+        creation_info = {}
+        element = None          # package or file being parsed
+        element_is_package = False
+        relationship = None     # RelationshipComment applies to the latest relationship
+        in_document = True
+        for tag, value in self._iter_tags():
+            if tag != 'RelationshipComment' and relationship is not None:
+                yield 'relationship', relationship
+                relationship = None
+            if in_document and tag in self.ELEMENT_TAGS:
+                in_document = False
+                if creation_info:
+                    header['creationInfo'] = creation_info
+            if tag in ('PackageName', 'FileName'):
+                if element is not None:
+                    yield 'package' if element_is_package else 'file', element
+                element = {}
+                element_is_package = tag == 'PackageName'
+
+            if tag == 'Relationship':
+                parts = value.split()
+                if len(parts) == 3:
+                    relationship = {'spdxElementId': parts[0], 'relationshipType': parts[1], 'relatedSpdxElement': parts[2]}
+            elif tag == 'RelationshipComment':
+                if relationship is not None:
+                    relationship['comment'] = value
+            elif in_document:
+                if tag in self.DOCUMENT_TAGS:
+                    header[self.DOCUMENT_TAGS[tag]] = value
+                elif tag == 'SPDXID':
+                    header['SPDXID'] = value
+                elif tag == 'Creator':
+                    creation_info.setdefault('creators', []).append(value)
+                elif tag in self.CREATION_TAGS:
+                    creation_info[self.CREATION_TAGS[tag]] = value
+            elif tag == 'SPDXID':
+                element['SPDXID'] = value
+            elif tag == 'FilesAnalyzed':
+                element['filesAnalyzed'] = value.lower() == 'true'
+            elif tag == 'ExternalRef':
+                parts = value.split(None, 2)
+                if len(parts) == 3:
+                    element.setdefault('externalRefs', []).append(
+                        {'referenceCategory': parts[0].replace('_', '-'), 'referenceType': parts[1], 'referenceLocator': parts[2]})
+            elif tag in ('PackageChecksum', 'FileChecksum'):
+                algorithm, _, checksum = value.partition(':')
+                element.setdefault('checksums', []).append({'algorithm': algorithm.strip(), 'checksumValue': checksum.strip()})
+            elif tag in self.LIST_TAGS:
+                element.setdefault(self.LIST_TAGS[tag], []).append(value)
+            elif element_is_package and tag in self.PACKAGE_TAGS:
+                element[self.PACKAGE_TAGS[tag]] = value
+            elif not element_is_package and tag in self.FILE_TAGS:
+                element[self.FILE_TAGS[tag]] = value
+            else:
+                msg = f"Ignoring tag '{tag}' in '{self.spdx_file_path}'"
+                logger.debug(msg)
+
+        if relationship is not None:
+            yield 'relationship', relationship
+        if in_document and creation_info:
+            header['creationInfo'] = creation_info
+        if element is not None:
+            yield 'package' if element_is_package else 'file', element
+
+    def _iter_kind(self, kind, header=None):
+        ''' One pass over the document for the elements of one kind '''
+        for element_kind, element in self._iter_elements({} if header is None else header):
+            if element_kind == kind:
+                yield element
+
+    def iter_json(self):
+        ''' The document as SPDX JSON str chunks '''
+        self.validate()
+        header = {}
+        packages = self._iter_kind('package', header)
+        # the header is complete once the first package (or the end of the document) is reached
+        first = next(packages, None)
+        yield from _json_document_chunks(header, 
+                                         itertools.chain([first] if first is not None else [], packages), 
+                                         lambda: self._iter_kind('file'), 
+                                         lambda: self._iter_kind('relationship'))
+
+
+class _JsonStreamReader:
+    '''
+        Pull reader over a JSON file that decodes one value at a time from a bounded buffer, so
+        large arrays can be walked (or skipped) element by element.
+    '''
+
+    WHITESPACE = ' \t\r\n'
+    DELIMITERS = WHITESPACE + ',:]}'
+
+    def __init__(self, f, chunk_size=64 * 1024):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        chunk = self.f.read(self.chunk_size)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        ''' Next non-whitespace character, or '' at end of file '''
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in self.WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf) or not self._fill():
+                return self.buf[self.pos:self.pos + 1]
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at '{self.buf[self.pos:self.pos + 20]}'")
+        self.pos += 1
+
+    def read_value(self):
+        ''' Decode the next complete JSON value '''
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # a number cut at the end of the buffer ('2' of '2.5') continues in the next chunk
+                if (end < len(self.buf) and self.buf[end] in self.DELIMITERS) or self.eof or not self._fill():
+                    self.pos = end
+                    return value
+            except ValueError:
+                if self.eof or not self._fill():
+                    raise
+
+    def iter_array(self):
+        ''' Position on each element of the array at the cursor; the caller consumes each element '''
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect(']')
+            return
+
+    def iter_object(self):
+        ''' Yield each key of the object at the cursor; the caller consumes each value '''
+        self.expect('{')
+        if self.peek() == '}':
+            self.pos += 1
+            return
+        while True:
+            key = self.read_value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self.pos += 1
+                continue
+            self.expect('}')
+            return
+
+    def skip_value(self):
+        ''' Consume the value at the cursor without holding a whole container in memory '''
+        char = self.peek()
+        if char == '[':
+            for _ in self.iter_array():
+                self.skip_value()
+        elif char == '{':
+            for _ in self.iter_object():
+                self.skip_value()
+        else:
+            self.read_value()
+
+
+class CycloneDxSpdxConverter:
+    '''
+        Convert a CycloneDX JSON BOM to SPDX JSON incrementally.
+
+        The BOM is read in passes with a _JsonStreamReader: metadata, components for the
+        packages, components again for the CONTAINS relationships of nested components, then
+        dependencies. Only one top-level component is decoded at a time, however large the BOM,
+        and nothing is spooled. SPDXIDs are derived from bom-refs, so relationships need no
+        bom-ref to SPDXID index.
+    '''
+
+    PURPOSES = {'application': 'APPLICATION', 'framework': 'FRAMEWORK', 'library': 'LIBRARY', 
+                'container': 'CONTAINER', 'operating-system': 'OPERATING-SYSTEM', 'device': 'DEVICE', 
+                'firmware': 'FIRMWARE', 'file': 'FILE'}
+
+    def __init__(self, spdx_file_path):
+        self.spdx_file_path = spdx_file_path
+
+    @staticmethod
+    def spdx_id(bom_ref):
+        ''' Deterministic SPDXID for a CycloneDX bom-ref '''
+        digest = hashlib.blake2b(bom_ref.encode('utf-8'), digest_size=8).hexdigest()
+        return f"SPDXRef-Package-{re.sub(r'[^A-Za-z0-9.-]+', '-', bom_ref)[:64].strip('-')}-{digest}"
+
+    def _iter_top_level(self, wanted):
+        ''' (key, reader) for each top-level key in wanted; other values are skipped '''
+        with open(self.spdx_file_path, 'r', encoding='utf-8') as f:
+            reader = _JsonStreamReader(f)
+            for key in reader.iter_object():
+                if key in wanted:
+                    yield key, reader
+                else:
+                    reader.skip_value()
+
+    def _header(self):
+        header = {'spdxVersion': 'SPDX-2.3', 'dataLicense': 'CC0-1.0', 'SPDXID': 'SPDXRef-DOCUMENT'}
+        metadata = {}
+        serial_number = None
+        bom_format = None
+        for key, reader in self._iter_top_level(('bomFormat', 'metadata', 'serialNumber')):
+            if key == 'bomFormat':
+                bom_format = reader.read_value()
+            elif key == 'metadata':
+                metadata = reader.read_value()
+            else:
+                serial_number = reader.read_value()
+        if bom_format != 'CycloneDX':
+            raise CoronaError(f"'{self.spdx_file_path}' is not a CycloneDX BOM: bomFormat is {bom_format!r}")
+        root = metadata.get('component') or {}
+        name = root.get('name') or os.path.splitext(os.path.basename(self.spdx_file_path))[0]
+        tools = metadata.get('tools') or []
+        if isinstance(tools, dict):     # CycloneDX 1.5+
+            tools = tools.get('components', [])
+        creators = [f"Tool: {'-'.join(str(t[k]) for k in ('name', 'version') if t.get(k))}" for t in tools if t.get('name')]
+        namespace_id = (serial_number or '').replace('urn:uuid:', '') or str(uuid.uuid5(uuid.NAMESPACE_URL, self.spdx_file_path))
+        header.update({
+            'name': name,
+            'documentNamespace': f"https://spdx.org/spdxdocs/{re.sub(r'[^A-Za-z0-9.-]+', '-', name)}-{namespace_id}",
+            'creationInfo': {
+                'creators': creators + [f'Tool: upload_spdx-{__version__}'],
+                'created': metadata.get('timestamp') or time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+        })
+        return header, root
+
+    def validate(self):
+        ''' Raise CoronaError unless the file is a JSON object with bomFormat "CycloneDX" '''
+        self._header()
+
+    def _component_id(self, component):
+        return self.spdx_id(component.get('bom-ref') or f"{component.get('name')}@{component.get('version')}")
+
+    def _package(self, component):
+        package = {
+            'name': component.get('name', 'NOASSERTION'),
+            'SPDXID': self._component_id(component),
+            'downloadLocation': 'NOASSERTION',
+            'filesAnalyzed': False,
+            'licenseConcluded': 'NOASSERTION',
+            'licenseDeclared': 'NOASSERTION',
+            'copyrightText': component.get('copyright') or 'NOASSERTION',
+            'supplier': f"Organization: {component['supplier']['name']}" if (component.get('supplier') or {}).get('name') else 'NOASSERTION',
+        }
+        if component.get('version'):
+            package['versionInfo'] = component['version']
+        if component.get('description'):
+            package['description'] = component['description']
+        if component.get('type') in self.PURPOSES:
+            package['primaryPackagePurpose'] = self.PURPOSES[component['type']]
+        licenses = [entry.get('expression') or (entry.get('license') or {}).get('id') for entry in component.get('licenses') or []]
+        licenses = [license for license in licenses if license]
+        if licenses:
+            package['licenseDeclared'] = ' AND '.join(f'({license})' if ' ' in license else license for license in licenses) \
+                if len(licenses) > 1 else licenses[0]
+        checksums = [{'algorithm': h['alg'].replace('-', ''), 'checksumValue': h['content']} 
+                     for h in component.get('hashes') or [] if h.get('alg') and h.get('content')]
+        if checksums:
+            package['checksums'] = checksums
+        refs = []
+        if component.get('cpe'):
+            refs.append({'referenceCategory': 'SECURITY', 'referenceType': 'cpe23Type', 'referenceLocator': component['cpe']})
+        if component.get('purl'):
+            refs.append({'referenceCategory': 'PACKAGE-MANAGER', 'referenceType': 'purl', 'referenceLocator': component['purl']})
+        if refs:
+            package['externalRefs'] = refs
+        return package
+
+    def _iter_components(self):
+        ''' (parent SPDXID or None, component) for every component, nested ones included '''
+        for _, reader in self._iter_top_level(('components',)):
+            for _ in reader.iter_array():
+                nested = [(None, reader.read_value())]
+                while nested:
+                    parent_id, component = nested.pop()
+                    nested.extend((self._component_id(component), child) for child in component.get('components') or [])
+                    yield parent_id, component
+
+    def _iter_packages(self, root):
+        if root:
+            yield self._package(root)
+        for _, component in self._iter_components():
+            yield self._package(component)
+
+    def _iter_relationships(self, root):
+        ''' DESCRIBES for the root, then a components pass for CONTAINS and a dependencies pass for DEPENDS_ON '''
+        if root:
+            yield {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 
+                   'relatedSpdxElement': self._component_id(root)}
+        for parent_id, component in self._iter_components():
+            if parent_id:
+                yield {'spdxElementId': parent_id, 'relationshipType': 'CONTAINS', 
+                       'relatedSpdxElement': self._component_id(component)}
+        for _, reader in self._iter_top_level(('dependencies',)):
+            for _ in reader.iter_array():
+                dependency = reader.read_value()
+                for depends_on in dependency.get('dependsOn') or []:
+                    yield {'spdxElementId': self.spdx_id(dependency['ref']), 'relationshipType': 'DEPENDS_ON', 
+                           'relatedSpdxElement': self.spdx_id(depends_on)}
+
+    def iter_json(self):
+        ''' The BOM as SPDX JSON str chunks '''
+        header, root = self._header()
+        yield from _json_document_chunks(header, self._iter_packages(root), list, lambda: self._iter_relationships(root))
+
+
+SPDX_INPUT_FORMATS = ('auto', 'spdx-json', 'spdx-tv', 'cyclonedx-json')
+
+
+def detect_input_format(spdx_file_path):
+    ''' 'spdx-tv', 'cyclonedx-json' or 'spdx-json', from the file extension and its first few KB '''
+    if spdx_file_path.endswith(('.spdx', '.tv', '.tag')):
+        return 'spdx-tv'
+    try:
+        with open(spdx_file_path, 'r', encoding='utf-8', errors='replace') as f:
+            head = f.read(16 * 1024)
+    except FileNotFoundError:
+        raise CoronaError(f"SPDX file '{spdx_file_path}' not found.")
+    if head.lstrip().startswith('SPDXVersion:'):
+        return 'spdx-tv'
+    if '"bomFormat"' in head and '"spdxVersion"' not in head:
+        return 'cyclonedx-json'
+    return 'spdx-json'
+
+
+def spdx_json_stream(spdx_file_path, input_format='auto'):
+    '''
+        Input adapter for SBOMs that are not SPDX JSON.
+
+        Returns:
+            callable returning SPDX JSON str chunks converted from spdx_file_path on the fly, or
+            None when the file already is SPDX JSON
+    '''
+    if input_format == 'auto':
+        input_format = detect_input_format(spdx_file_path)
+    if input_format == 'spdx-json':
+        return None
+    if not os.path.isfile(spdx_file_path):
+        raise CoronaError(f"SPDX file '{spdx_file_path}' not found.")
+    converter = {'spdx-tv': TagValueSpdxConverter, 'cyclonedx-json': CycloneDxSpdxConverter}[input_format](spdx_file_path)
+    # a forced or misdetected format would convert to an empty SBOM, replacing the image's components
+    try:
+        converter.validate()
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        raise CoronaError(f"Unable to convert '{spdx_file_path}' ({input_format}): {e}") from e
+    msg = f"Converting '{spdx_file_path}' ({input_format}) to SPDX JSON while uploading"
+    logger.info(msg)
+
+    def _chunks():
+        try:
+            yield from converter.iter_json()
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            raise CoronaError(f"Unable to convert '{spdx_file_path}' ({input_format}): {e}") from e
+    return _chunks
+
+
 class SpdxManager(CoronaAPIClient):
     '''Handle spdx-related operations.'''
 
-    def update_or_add_spdx(self, image_id, spdx_file_path):
+    UPLOAD_OPTIONS = {
+        'ignore_relationships': 'true',
+        'ignore_eo_compliant': 'true',
+        'ignore_validation': 'true',
+    }
+
+    def update_or_add_spdx(self, image_id, spdx_file_path, dedupe=False):
         '''  Update or add the contents of the spdx_file_path to Corona image_id
 
+        dedupe: when true, duplicate packages are collapsed (see SpdxDeduplicator) and the
+                rewritten document is uploaded instead of the file as-is.
+
         spdx_data:
         - ignore_relationships, boolean - default false; It is common for SPDX files to use relationships to describe the packages. By default only the packages contained in the described packages will be imported. When relationships are ignored (true) all packages will be imported.
             - "ignore_relationships": "false",  # gets rid of main package as a Corona component DOESN"T SEEM TO BE TRUE ANYMORE - JG fixed my complaint!
@@ -309,11 +1313,10 @@ class SpdxManager(CoronaAPIClient):
             - Corona already knows SPDX is from Syft.  It reads "Tool" param from JSON:
             "discovery_tool": "Syft"
         '''
-        spdx_data = {
-            'ignore_relationships': 'true',
-            'ignore_eo_compliant': 'true',
-            'ignore_validation': 'true',
-        }
+        if dedupe:
+            return self.upload_prepared_spdx(image_id, PreparedSpdx.from_file(spdx_file_path, dedupe=True))
+
+        spdx_data = dict(self.UPLOAD_OPTIONS)
         try:
             with open(spdx_file_path, 'r') as f:
                 spdx_data['data'] = f.read()
@@ -333,27 +1336,1189 @@ class SpdxManager(CoronaAPIClient):
 
         return res_json
 
+    def upload_prepared_spdx(self, image_id, prepared):
+        ''' Upload a PreparedSpdx to Corona image_id using the same two requests as update_or_add_spdx() '''
+        spdx_data = dict(self.UPLOAD_OPTIONS, data=prepared.text)
+        self.make_authenticated_request('POST', 
+                                        f'api/v2/images/{image_id}/spdx.json', 
+                                        data=spdx_data)
+        return self.make_authenticated_request('POST', 
+                                               f'api/v2/images/{image_id}/spdx.json', 
+                                               files={'data': (prepared.file_name, prepared.content)})
+
+    def upload_spdx_stream(self, image_id, file_name, chunks):
+        '''
+            Upload SPDX JSON produced on the fly to Corona image_id as a single streamed multipart request.
+
+            The JSON-body request of update_or_add_spdx() needs the whole document in memory, so the
+            upload options are sent as form fields of the file upload instead.
+
+            Args:
+                file_name: name of the uploaded file part
+                chunks: callable returning an iterable of SPDX JSON str chunks, called again on retry
+        '''
+        boundary = uuid.uuid4().hex
+
+        def _body():
+            for name, value in self.UPLOAD_OPTIONS.items():
+                yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n').encode('utf-8')
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="data"; filename="{file_name}"\r\n'
+                   'Content-Type: application/json\r\n\r\n').encode('utf-8')
+            for chunk in chunks():
+                yield chunk.encode('utf-8')
+            yield f'\r\n--{boundary}--\r\n'.encode('utf-8')
+
+        return self.make_authenticated_request('POST', 
+                                               f'api/v2/images/{image_id}/spdx.json', 
+                                               body=lambda: (f'multipart/form-data; boundary={boundary}', _body()))
+
+
+class CoronaUploader:
+    '''Resolve the product/release/image hierarchy and upload SPDX content on a single Corona host.'''
+
+    def __init__(self, host, user_name, pat=None, response_cache=None, credential_pool=None):
+        self.host = host
+        self.credential_pool = credential_pool
+        # one session (kept-alive connection) and one sign-in shared by all the managers
+        self.session = requests.Session()
+        self.product_manager = ProductManager(host, user_name, pat, response_cache, self.session, credential_pool)
+        self.release_manager = ReleaseManager(host, user_name, pat, response_cache, self.session, credential_pool)
+        self.image_manager = ImageManager(host, user_name, pat, response_cache, self.session, credential_pool)
+        self.spdx_manager = SpdxManager(host, user_name, pat, response_cache, self.session, credential_pool)
+
+    def sign_in(self):
+        ''' Sign in once, opening the session's connection, and share the token with every manager '''
+        if self.credential_pool is not None:
+            return None    # each pooled account signs in on its first request
+        token = self.product_manager.get_auth_token()
+        for manager in (self.release_manager, self.image_manager, self.spdx_manager):
+            manager.token = token
+        return token
+
+    def resolve_image(self, product_name, release_version, image_name):
+        ''' Retrieve or create the product, release and image; returns the image_id '''
+        self.sign_in()
+        product_id = self.product_manager.get_or_create_product(product_name)
+        release_id = self.release_manager.get_or_create_release(product_id, release_version)
+        return self.image_manager.get_or_create_image(product_id, release_id, image_name)
+
+    def upload(self, product_name, release_version, image_name, prepared):
+        ''' Resolve the image and upload the PreparedSpdx to it; returns the image_id '''
+        image_id = self.resolve_image(product_name, release_version, image_name)
+        self.spdx_manager.upload_prepared_spdx(image_id, prepared)
+        return image_id
+
+
+def fan_out_upload(targets, product_name, release_version, image_name, prepared, max_workers=None, response_cache=None):
+    '''
+        Upload one PreparedSpdx to several Corona hosts concurrently.
+
+        Args:
+            targets: list of (host, user_name, pat) tuples; each host gets its own clients and tokens
+            product_name, release_version, image_name: where in Corona the SPDX is uploaded
+            prepared: PreparedSpdx, read once and shared by all hosts
+            max_workers: number of hosts uploaded to at once, defaults to len(targets)
+            response_cache: optional ResponseCache shared by all hosts (entries are keyed by host)
+
+        Returns:
+            dict of host -> {'image_id': image_id or None, 'error': error message or None}
+    '''
+    def _upload_to(target):
+        host, user_name, pat = target
+        uploader = CoronaUploader(host, user_name, pat, response_cache, CredentialPool.from_config(host))
+        return uploader.upload(product_name, release_version, image_name, prepared)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers or len(targets) or 1) as executor:
+        futures = {executor.submit(_upload_to, target): target[0] for target in targets}
+        for future in as_completed(futures):
+            host = futures[future]
+            try:
+                image_id = future.result()
+                results[host] = {'image_id': image_id, 'error': None}
+                msg = f"Host '{host}': SPDX added to image_id {image_id}"
+                logger.info(msg)
+            except CoronaError as e:
+                results[host] = {'image_id': None, 'error': str(e)}
+            except SystemExit as e:
+                # _handle_error() exits on non-retryable HTTP errors; contain it to this host
+                results[host] = {'image_id': None, 'error': f'HTTP error {e.code}'}
+            except Exception as e:
+                # e.g., a proxy's HTML error page failing to decode as JSON; still only this host fails
+                results[host] = {'image_id': None, 'error': f'{type(e).__name__}: {e}'}
+            if results[host]['error']:
+                msg = f"Host '{host}': SPDX upload failed: {results[host]['error']}"
+                logger.error(msg)
+    return results
+
+
+class SyntheticSpdxGenerator:
+    '''
+        Generate Syft-style SPDX JSON documents modeled on bes-traceability-spdx.json.
+
+        Args:
+            package_count: number of packages, including duplicates
+            duplication: fraction of packages that re-list an earlier package's purl (0.0 - 1.0)
+            relationship_density: average number of DEPENDS_ON relationships per package,
+                                  on top of the CONTAINS/evident-by relationships Syft emits
+            seed: random seed, for reproducible documents
+    '''
+
+    def __init__(self, package_count=285, duplication=0.0, relationship_density=0.0, seed=None):
+        self.package_count = package_count
+        self.duplication = duplication
+        self.relationship_density = relationship_density
+        self.random = random.Random(seed)
+
+    def _spdx_id(self, name):
+        return f'SPDXRef-Package-rust-crate-{name}-{self.random.getrandbits(64):016x}'
+
+    def generate(self, name='synthetic-main'):
+        ''' A synthetic SPDX document as a dict '''
+        root_id = f'SPDXRef-DocumentRoot-Directory-{name}'
+        file_id = f'SPDXRef-File-Cargo.lock-{self.random.getrandbits(64):016x}'
+        packages = []
+        relationships = [{'spdxElementId': 'SPDXRef-DOCUMENT', 'relatedSpdxElement': root_id, 'relationshipType': 'DESCRIBES'}]
+        for i in range(self.package_count):
+            if packages and self.random.random() < self.duplication:
+                original = self.random.choice(packages)
+                crate, version = original['name'], original['versionInfo']
+            else:
+                crate, version = f'crate-{i}', f'{i % 7}.{i % 13}.{i % 3}'
+            spdx_id = self._spdx_id(crate)
+            packages.append({
+                'name': crate,
+                'SPDXID': spdx_id,
+                'versionInfo': version,
+                'supplier': 'NOASSERTION',
+                'downloadLocation': 'NOASSERTION',
+                'filesAnalyzed': False,
+                'sourceInfo': 'acquired package info from rust cargo manifest: /Cargo.lock',
+                'licenseConcluded': 'NOASSERTION',
+                'licenseDeclared': 'NOASSERTION',
+                'copyrightText': 'NOASSERTION',
+                'externalRefs': [
+                    {'referenceCategory': 'SECURITY', 'referenceType': 'cpe23Type', 
+                     'referenceLocator': f'cpe:2.3:a:{crate}:{crate}:{version}:*:*:*:*:rust:*:*'},
+                    {'referenceCategory': 'PACKAGE-MANAGER', 'referenceType': 'purl', 
+                     'referenceLocator': f'pkg:cargo/{crate}@{version}'},
+                ],
+            })
+            relationships.append({'spdxElementId': spdx_id, 'relatedSpdxElement': file_id, 'relationshipType': 'OTHER', 
+                                  'comment': "evident-by: indicates the package's existence is evident by the given file"})
+            relationships.append({'spdxElementId': root_id, 'relatedSpdxElement': spdx_id, 'relationshipType': 'CONTAINS'})
+        for package in packages:
+            # integer part of the density, plus one more with the probability of its fractional part
+            dependencies = int(self.relationship_density) + (self.random.random() < self.relationship_density % 1)
+            for _ in range(dependencies if len(packages) > 1 else 0):
+                dependency = self.random.choice(packages)
+                if dependency is not package:
+                    relationships.append({'spdxElementId': package['SPDXID'], 'relatedSpdxElement': dependency['SPDXID'], 
+                                          'relationshipType': 'DEPENDS_ON'})
+        packages.append({'name': name, 'SPDXID': root_id, 'supplier': 'NOASSERTION', 'downloadLocation': 'NOASSERTION', 
+                         'filesAnalyzed': False, 'licenseConcluded': 'NOASSERTION', 'licenseDeclared': 'NOASSERTION', 
+                         'primaryPackagePurpose': 'FILE'})
+        return {
+            'spdxVersion': 'SPDX-2.3',
+            'dataLicense': 'CC0-1.0',
+            'SPDXID': 'SPDXRef-DOCUMENT',
+            'name': name,
+            'documentNamespace': f'https://anchore.com/syft/dir/{name}-{self.random.getrandbits(128):032x}',
+            'creationInfo': {
+                'licenseListVersion': '3.24',
+                'creators': ['Organization: Anchore, Inc', 'Tool: syft-1.9.0'],
+                'created': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            },
+            'packages': packages,
+            'files': [{'fileName': '/Cargo.lock', 'SPDXID': file_id, 
+                       'checksums': [{'algorithm': 'SHA1', 'checksumValue': '0' * 40}], 
+                       'licenseConcluded': 'NOASSERTION', 'licenseInfoInFiles': ['NOASSERTION'], 'copyrightText': ''}],
+            'relationships': relationships,
+        }
+
+    def prepared(self, name='synthetic-main'):
+        ''' A synthetic SPDX document as a PreparedSpdx '''
+        content = json.dumps(self.generate(name), separators=(',', ':')).encode('utf-8')
+        return PreparedSpdx(f'{name}.spdx.json', content)
+
+
+def percentile(sorted_values, pct):
+    ''' Nearest-rank percentile of an already sorted list; None when empty '''
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class LoadGenerator:
+    '''
+        Drive SPDX uploads to an existing image at a target concurrency or rate, and
+        report throughput, latency percentiles and error/throttle rates over time.
+
+        Args:
+            host, user_name, pat: Corona host and credentials, host may be http://... for a stand-in server
+            image_id: image the documents are uploaded to
+            documents: list of PreparedSpdx, uploaded round-robin
+            concurrency: maximum uploads in flight
+            rate: target uploads per second; None runs closed-loop at full concurrency
+            total: number of uploads to issue
+            duration: stop issuing uploads after this many seconds, if set
+            credential_pool: optional CredentialPool to spread the uploads over
+    '''
+
+    def __init__(self, host, user_name, pat, image_id, documents, concurrency=4, rate=None, total=100, duration=None, 
+                 credential_pool=None):
+        self.host = host
+        self.credential_pool = credential_pool
+        self.user_name = user_name
+        self.pat = pat
+        self.image_id = image_id
+        self.documents = documents
+        self.concurrency = concurrency
+        self.rate = rate
+        self.total = total
+        self.duration = duration
+        # (start offset, latency, outcome, start lag), outcome is 'ok', 'throttled' or 'error'
+        self.samples = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._issued = 0
+
+    def _spdx_manager(self):
+        # one client (and token) per worker thread
+        if not hasattr(self._local, 'spdx_manager'):
+            self._local.spdx_manager = SpdxManager(self.host, self.user_name, self.pat, credential_pool=self.credential_pool)
+        return self._local.spdx_manager
+
+    def _next(self):
+        ''' Index of the next upload to issue, or None when the load is complete '''
+        with self._lock:
+            if self._issued >= self.total:
+                return None
+            if self.duration is not None and time.monotonic() - self._started >= self.duration:
+                return None
+            self._issued += 1
+            return self._issued - 1
+
+    def _upload(self, index, scheduled=None):
+        '''
+            Upload document index, timed from scheduled (the time.monotonic() it was due to go out)
+            so that time spent waiting for a free worker counts in the latency at a target rate
+        '''
+        spdx_manager = self._spdx_manager()
+        throttled_before = spdx_manager.throttled_requests
+        started = time.monotonic()
+        if scheduled is None:
+            scheduled = started
+        try:
+            spdx_manager.upload_prepared_spdx(self.image_id, self.documents[index % len(self.documents)])
+            outcome = 'throttled' if spdx_manager.throttled_requests > throttled_before else 'ok'
+        except (CoronaError, SystemExit) as e:
+            outcome = 'error'
+            msg = f'Upload {index} failed: {e}'
+            logger.debug(msg)
+        except Exception as e:
+            # e.g., a proxy's HTML 413 page failing to decode as JSON; still a failed upload
+            outcome = 'error'
+            msg = f'Upload {index} failed: {type(e).__name__}: {e}'
+            logger.debug(msg)
+        with self._lock:
+            self.samples.append((scheduled - self._started, time.monotonic() - scheduled, outcome, started - scheduled))
+
+    def _closed_loop_worker(self):
+        index = self._next()
+        while index is not None:
+            self._upload(index)
+            index = self._next()
+
+    def run(self, interval=10.0):
+        ''' Issue the load and return summary() of the samples, in windows of interval seconds '''
+        self._started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            if not self.rate:
+                for _ in range(self.concurrency):
+                    executor.submit(self._closed_loop_worker)
+            else:
+                index = self._next()
+                while index is not None:
+                    scheduled = self._started + index / self.rate
+                    delay = scheduled - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                    executor.submit(self._upload, index, scheduled)
+                    index = self._next()
+        return self.summary(time.monotonic() - self._started, interval)
+
+    def summary(self, elapsed, interval=10.0):
+        '''
+            Summarize the samples.
+
+            Returns:
+                dict with overall 'uploads', 'throughput' (uploads/s), 'error_rate', 'throttle_rate',
+                'latency' percentiles (p50/p90/p99/max, seconds), 'max_start_lag' (seconds the latest
+                upload waited for a worker past its scheduled start) and the same per 'intervals'
+                window, plus 'target_rate' and the 'rate_achieved' fraction of it at a target rate
+        '''
+        def _stats(samples, seconds):
+            latencies = sorted(sample[1] for sample in samples)
+            count = len(samples)
+            return {
+                'uploads': count,
+                'throughput': count / seconds if seconds > 0 else 0.0,
+                'error_rate': sum(1 for sample in samples if sample[2] == 'error') / count if count else 0.0,
+                'throttle_rate': sum(1 for sample in samples if sample[2] == 'throttled') / count if count else 0.0,
+                'latency': {
+                    'p50': percentile(latencies, 50),
+                    'p90': percentile(latencies, 90),
+                    'p99': percentile(latencies, 99),
+                    'max': latencies[-1] if latencies else None,
+                },
+                'max_start_lag': max((sample[3] for sample in samples), default=None),
+            }
+
+        report = _stats(self.samples, elapsed)
+        report['elapsed'] = elapsed
+        report['target_rate'] = self.rate
+        report['rate_achieved'] = report['throughput'] / self.rate if self.rate else None
+        report['intervals'] = []
+        for window in range(max(1, math.ceil(elapsed / interval))):
+            samples = [sample for sample in self.samples if window * interval <= sample[0] < (window + 1) * interval]
+            window_stats = _stats(samples, min(interval, elapsed - window * interval))
+            window_stats['start'] = window * interval
+            report['intervals'].append(window_stats)
+        return report
+
+
+class BatchJob:
+    '''
+        One SPDX file to upload and where in Corona it goes.
+
+        For the ci command, inputs are glob patterns (relative to base_dir) of the files the SBOM
+        is generated from, e.g., Cargo.lock or Dockerfile, and generate is the shell command that
+        (re)generates spdx_file_path from them.
+    '''
+
+    def __init__(self, product_name, release_version, image_name, spdx_file_path, host=None, 
+                 inputs=None, generate=None, base_dir='.'):
+        self.product_name = product_name
+        self.release_version = release_version
+        self.image_name = image_name
+        self.spdx_file_path = spdx_file_path
+        self.host = host or CoronaConfig.get_host()
+        self.inputs = inputs or []
+        self.generate = generate
+        self.base_dir = base_dir
+
+    @property
+    def key(self):
+        return f'{self.host}|{self.product_name}|{self.release_version}|{self.image_name}'
+
+    def __repr__(self):
+        return f"BatchJob('{self.host}', '{self.product_name}', '{self.release_version}', '{self.image_name}', '{self.spdx_file_path}')"
+
+
+def load_manifest(manifest_path):
+    '''
+        Read a batch manifest: a JSON list of
+            {"product": ..., "release": ..., "image": ..., "spdx_file": ..., "host": ... (optional),
+             "inputs": [...] (optional), "generate": ... (optional)}
+        Relative spdx_file paths and inputs patterns are relative to the manifest's directory.
+
+        Returns:
+            list of BatchJob
+    '''
+    try:
+        with open(manifest_path, 'r') as f:
+            entries = json.load(f)
+    except FileNotFoundError:
+        raise CoronaError(f"Manifest '{manifest_path}' not found.")
+    except ValueError as e:
+        raise CoronaError(f"Manifest '{manifest_path}' is not valid JSON: {e}") from e
+
+    base_dir = os.path.dirname(os.path.abspath(manifest_path))
+    try:
+        return [BatchJob(entry['product'], 
+                         entry['release'], 
+                         entry['image'], 
+                         os.path.join(base_dir, entry['spdx_file']), 
+                         entry.get('host'), 
+                         entry.get('inputs'), 
+                         entry.get('generate'), 
+                         base_dir) for entry in entries]
+    except (KeyError, TypeError) as e:
+        raise CoronaError(f"Manifest '{manifest_path}' entries need product, release, image and spdx_file: {e}") from e
+
+
+class SpdxArtifact:
+    '''An upload-ready SPDX document spooled to disk by prepare_spdx_artifact().'''
+
+    def __init__(self, file_name, path, sha256, size):
+        self.file_name = file_name
+        self.path = path
+        self.sha256 = sha256
+        self.size = size
+
+    def load(self):
+        ''' Read the artifact back as a PreparedSpdx '''
+        with open(self.path, 'rb') as f:
+            return PreparedSpdx(self.file_name, f.read())
+
+    def discard(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+def prepare_spdx_artifact(spdx_file_path, spool_dir, dedupe=False):
+    '''
+        CPU-bound preparation of one SPDX file, run in a worker process: read, validate,
+        optionally de-duplicate, compact and hash it, and spool the result into spool_dir.
+
+        Returns:
+            SpdxArtifact
+    '''
+    try:
+        with open(spdx_file_path, 'rb') as f:
+            content = f.read()
+    except FileNotFoundError:
+        raise CoronaError(f"SPDX file '{spdx_file_path}' not found.")
+    content = slim_spdx(content, spdx_file_path, dedupe=dedupe, validate=True)
+    sha256 = hashlib.sha256(content).hexdigest()
+    fd, path = tempfile.mkstemp(prefix=f'{sha256[:16]}-', suffix='.json', dir=spool_dir)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    return SpdxArtifact(os.path.basename(spdx_file_path), path, sha256, len(content))
+
+
+class ShardRing:
+    '''
+        Consistent-hash ring that assigns each (product, release) to one of shard_count nodes.
+
+        Every node builds the same ring, so a manifest is partitioned deterministically without
+        coordination, and changing the node count only moves about 1/shard_count of the keys.
+    '''
+
+    def __init__(self, shard_count, replicas=64):
+        self.shard_count = shard_count
+        self._points = sorted((self._hash(f'shard-{shard}-{replica}'), shard) 
+                              for shard in range(shard_count) for replica in range(replicas))
+        self._hashes = [point[0] for point in self._points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(hashlib.sha256(key.encode('utf-8')).digest()[:8], 'big')
+
+    def shard_for(self, product_name, release_version):
+        ''' Shard index (0 .. shard_count - 1) owning (product_name, release_version) '''
+        position = bisect.bisect(self._hashes, self._hash(f'{product_name}\0{release_version}'))
+        return self._points[position % len(self._points)][1]
+
+    def select(self, jobs, shard_index):
+        ''' The BatchJobs in jobs owned by shard_index '''
+        return [job for job in jobs if self.shard_for(job.product_name, job.release_version) == shard_index]
+
+
+class LeaseLock:
+    '''
+        Mutual exclusion between nodes through a lease file on a shared filesystem.
+
+        The lease is created with O_CREAT | O_EXCL, so only one node holds it. While held, a
+        heartbeat thread touches the lease file every ttl / 4 seconds. A waiting node breaks the
+        lease only after its mtime has not changed for ttl seconds of the waiter's own monotonic
+        clock, so clock skew between nodes and the file server does not matter, and a live holder
+        is never broken however long its requests take.
+
+        Usage:
+            with LeaseLock(lock_dir, f'{host}/product/{product_name}'):
+                product_manager.get_or_create_product(product_name)
+    '''
+
+    def __init__(self, lock_dir, name, ttl=LEASE_TTL, timeout=None, poll_interval=0.5):
+        self.name = name
+        self.path = os.path.join(lock_dir, f"{hashlib.sha256(name.encode('utf-8')).hexdigest()[:32]}.lease")
+        self.ttl = ttl
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+        self._observed = None    # (inode, mtime) of the lease being waited on, time.monotonic() it last changed
+        self._heartbeat = None
+        self._stop_heartbeat = threading.Event()
+
+    def _try_create(self):
+        try:
+            fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return False
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'name': self.name, 'token': self.token, 'acquired': time.time()}, f)
+        return True
+
+    def _read_token(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f).get('token')
+        except (OSError, ValueError):
+            return None
+
+    def _heartbeat_loop(self):
+        while not self._stop_heartbeat.wait(self.ttl / 4):
+            if self._read_token(self.path) != self.token:
+                msg = f"Lease for '{self.name}' was lost while held"
+                logger.warning(msg)
+                return
+            try:
+                os.utime(self.path)
+            except OSError as e:
+                msg = f"Unable to renew lease for '{self.name}': {e}"
+                logger.warning(msg)
+
+    def _break_if_stale(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self._observed = None
+            return
+        seen = (stat.st_ino, stat.st_mtime_ns)
+        now = time.monotonic()
+        if self._observed is None or self._observed[0] != seen:
+            self._observed = (seen, now)
+            return
+        if now - self._observed[1] < self.ttl:
+            return
+        self._observed = None
+        stale_token = self._read_token(self.path)
+        broken_path = f'{self.path}.{uuid.uuid4().hex}.broken'
+        try:
+            os.rename(self.path, broken_path)
+        except FileNotFoundError:
+            return    # another node broke it first
+        if self._read_token(broken_path) == stale_token:
+            msg = f"Broke stale lease for '{self.name}' ({stale_token})"
+            logger.warning(msg)
+        else:
+            # another node broke the stale lease and took a fresh one in between; put it back
+            try:
+                os.link(broken_path, self.path)
+            except OSError:
+                pass
+        os.remove(broken_path)
+
+    def acquire(self):
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        while not self._try_create():
+            self._break_if_stale()
+            if deadline is not None and time.monotonic() >= deadline:
+                raise CoronaError(f"Timed out waiting for lease '{self.name}' ({self.path})")
+            time.sleep(self.poll_interval)
+        self._stop_heartbeat.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, daemon=True)
+        self._heartbeat.start()
+
+    def release(self):
+        if self._heartbeat is not None:
+            self._stop_heartbeat.set()
+            self._heartbeat.join()
+            self._heartbeat = None
+        if self._read_token(self.path) == self.token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class UploadScheduler:
+    '''
+        Bounded, size-aware hand-off between SPDX preparation and upload threads.
+
+        get() hands out the largest waiting upload that may start now, so the biggest transfers
+        start first instead of dominating the end of the batch. An upload of large_threshold
+        bytes or more may start only while fewer than max_large_per_host large uploads run on
+        its host, and no upload may start that would push the bytes in flight above
+        max_bytes_in_flight (unless nothing is in flight). Smaller uploads fill the threads
+        the waiting large ones cannot use. put() blocks while capacity uploads are waiting.
+    '''
+
+    def __init__(self, capacity, large_threshold=10 * 1024 * 1024, max_large_per_host=2, max_bytes_in_flight=None):
+        self.capacity = capacity
+        self.large_threshold = large_threshold
+        self.max_large_per_host = max(1, max_large_per_host)
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self._waiting = []    # (-size, sequence, host, item), largest first
+        self._sequence = 0
+        self._large_in_flight = {}
+        self._bytes_in_flight = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, item, host, size):
+        ''' Queue item for upload to host, blocking while capacity items are already waiting '''
+        with self._condition:
+            while len(self._waiting) >= self.capacity:
+                self._condition.wait()
+            bisect.insort(self._waiting, (-size, self._sequence, host, item))
+            self._sequence += 1
+            self._condition.notify_all()
+
+    def close(self):
+        ''' No more puts; get() returns None once every waiting item has been handed out '''
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def _admissible(self, host, size):
+        if size >= self.large_threshold and self._large_in_flight.get(host, 0) >= self.max_large_per_host:
+            return False
+        if self.max_bytes_in_flight and self._bytes_in_flight and self._bytes_in_flight + size > self.max_bytes_in_flight:
+            return False
+        return True
+
+    def get(self):
+        '''
+            Wait for the largest admissible upload.
+
+            Returns:
+                (item, host, size), to be passed to done() when the upload finishes, or None when closed and drained
+        '''
+        with self._condition:
+            while True:
+                for position, (negative_size, _, host, item) in enumerate(self._waiting):
+                    if self._admissible(host, -negative_size):
+                        del self._waiting[position]
+                        size = -negative_size
+                        if size >= self.large_threshold:
+                            self._large_in_flight[host] = self._large_in_flight.get(host, 0) + 1
+                        self._bytes_in_flight += size
+                        self._condition.notify_all()
+                        return item, host, size
+                if self._closed and not self._waiting:
+                    return None
+                self._condition.wait()
+
+    def done(self, host, size):
+        ''' Release the in-flight capacity taken by get() '''
+        with self._condition:
+            if size >= self.large_threshold:
+                self._large_in_flight[host] -= 1
+            self._bytes_in_flight -= size
+            self._condition.notify_all()
+
+
+class SpdxBatchPipeline:
+    '''
+        Upload a batch of SPDX files in two overlapped stages.
+
+        A process pool prepares files into spooled SpdxArtifacts (CPU-bound: parse, validate,
+        de-duplicate, compact, hash) while a pool of I/O threads resolves the Corona hierarchy
+        and uploads them. The stages are connected by a bounded UploadScheduler: when the
+        uploaders fall behind, preparation stops until a slot frees up, so at most
+        queue_size + cpu_workers artifacts are spooled at any time. Files are prepared and
+        uploaded largest first, with per-host limits on concurrent large uploads.
+
+        Args:
+            cpu_workers: preparation processes, defaults to os.cpu_count()
+            io_workers: upload threads
+            queue_size: prepared artifacts waiting for upload, defaults to 2 * io_workers
+            spool_dir: where artifacts are spooled, defaults to a temporary directory
+            dedupe: de-duplicate packages while preparing
+            response_cache: optional ResponseCache shared by the upload threads
+            lock_dir: shared directory for LeaseLocks, so that batch nodes sharing it never
+                      create the same product/release/image concurrently
+            lease_ttl: seconds after which a lease left behind by a crashed node is broken
+            large_threshold, max_large_per_host, max_bytes_in_flight: see UploadScheduler
+    '''
+
+    def __init__(self, cpu_workers=None, io_workers=4, queue_size=None, spool_dir=None, dedupe=False, response_cache=None, 
+                 lock_dir=None, lease_ttl=LEASE_TTL, large_threshold=10 * 1024 * 1024, max_large_per_host=2, max_bytes_in_flight=None):
+        self.cpu_workers = cpu_workers or os.cpu_count() or 1
+        self.io_workers = io_workers
+        self.queue_size = queue_size or 2 * io_workers
+        self.spool_dir = spool_dir
+        self.dedupe = dedupe
+        self.response_cache = response_cache
+        self.lock_dir = lock_dir
+        self.lease_ttl = lease_ttl
+        self.large_threshold = large_threshold
+        self.max_large_per_host = max_large_per_host
+        self.max_bytes_in_flight = max_bytes_in_flight
+        if lock_dir:
+            os.makedirs(lock_dir, exist_ok=True)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._product_locks = {}
+        self._credential_pools = {}
+
+    def _credential_pool(self, host):
+        # one pool per host, shared by all upload threads so load is balanced across them
+        with self._lock:
+            if host not in self._credential_pools:
+                self._credential_pools[host] = CredentialPool.from_config(host)
+            return self._credential_pools[host]
+
+    def _uploader(self, host):
+        # one set of clients (and tokens) per upload thread and host
+        if not hasattr(self._local, 'uploaders'):
+            self._local.uploaders = {}
+        uploaders = self._local.uploaders
+        if host not in uploaders:
+            uploaders[host] = CoronaUploader(host, 
+                                             CoronaConfig.get_target_user_name(host), 
+                                             CoronaConfig.get_target_pat(host), 
+                                             self.response_cache, 
+                                             self._credential_pool(host))
+        return uploaders[host]
+
+    def _resolve_image(self, uploader, job):
+        ''' Resolve the image, serialized per product so two threads never create the same entity '''
+        with self._lock:
+            product_lock = self._product_locks.setdefault((job.host, job.product_name), threading.Lock())
+        with product_lock:
+            if not self.lock_dir:
+                return uploader.resolve_image(job.product_name, job.release_version, job.image_name)
+            return self._resolve_image_leased(uploader, job)
+
+    def _resolve_image_leased(self, uploader, job):
+        ''' Resolve the image holding a cross-node lease around each get-or-create '''
+        uploader.sign_in()
+        with LeaseLock(self.lock_dir, f'{job.host}/product/{job.product_name}', self.lease_ttl):
+            product_id = uploader.product_manager.get_or_create_product(job.product_name)
+        with LeaseLock(self.lock_dir, f'{job.host}/release/{product_id}/{job.release_version}', self.lease_ttl):
+            release_id = uploader.release_manager.get_or_create_release(product_id, job.release_version)
+        with LeaseLock(self.lock_dir, f'{job.host}/image/{release_id}/{job.image_name}', self.lease_ttl):
+            return uploader.image_manager.get_or_create_image(product_id, release_id, job.image_name)
+
+    def _upload(self, job, artifact):
+        uploader = self._uploader(job.host)
+        image_id = self._resolve_image(uploader, job)
+        uploader.spdx_manager.upload_prepared_spdx(image_id, artifact.load())
+        return image_id
+
+    def _upload_worker(self, scheduler, results):
+        while True:
+            scheduled = scheduler.get()
+            if scheduled is None:
+                return
+            (index, job, artifact), host, size = scheduled
+            try:
+                image_id = self._upload(job, artifact)
+                results[index] = {'job': job, 'image_id': image_id, 'error': None}
+                msg = f"SPDX '{job.spdx_file_path}' added to '{job.product_name}' v'{job.release_version}', image '{job.image_name}' ({image_id})"
+                logger.info(msg)
+            except (CoronaError, OSError) as e:
+                results[index] = {'job': job, 'image_id': None, 'error': str(e)}
+            except SystemExit as e:
+                results[index] = {'job': job, 'image_id': None, 'error': f'HTTP error {e.code}'}
+            except Exception as e:
+                # an unexpected failure must not take the thread away from the scheduler
+                results[index] = {'job': job, 'image_id': None, 'error': f'{type(e).__name__}: {e}'}
+            finally:
+                artifact.discard()
+                scheduler.done(host, size)
+            if results[index]['error']:
+                msg = f"SPDX '{job.spdx_file_path}' upload failed: {results[index]['error']}"
+                logger.error(msg)
+
+    @staticmethod
+    def _file_size(job):
+        try:
+            return os.path.getsize(job.spdx_file_path)
+        except OSError:
+            return 0
+
+    def _prepare_all(self, jobs, spool_dir, scheduler, results):
+        # largest first, so the longest uploads are not the last ones to start
+        jobs = iter(sorted(enumerate(jobs), key=lambda indexed_job: -self._file_size(indexed_job[1])))
+        with ProcessPoolExecutor(max_workers=self.cpu_workers) as pool:
+            pending = {}
+
+            def _submit_next():
+                for index, job in jobs:
+                    try:
+                        pending[pool.submit(prepare_spdx_artifact, job.spdx_file_path, spool_dir, self.dedupe)] = (index, job)
+                        return
+                    except Exception as e:
+                        # e.g., BrokenProcessPool after a worker died
+                        self._prepare_failed(results, index, job, e)
+
+            for _ in range(self.cpu_workers):
+                _submit_next()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, job = pending.pop(future)
+                    try:
+                        # blocks while the scheduler is full (backpressure on preparation)
+                        artifact = future.result()
+                        scheduler.put((index, job, artifact), job.host, artifact.size)
+                    except Exception as e:
+                        self._prepare_failed(results, index, job, e)
+                    _submit_next()
+
+    @staticmethod
+    def _prepare_failed(results, index, job, e):
+        error = str(e) if isinstance(e, (CoronaError, OSError)) else f'{type(e).__name__}: {e}'
+        results[index] = {'job': job, 'image_id': None, 'error': error}
+        msg = f"SPDX '{job.spdx_file_path}' preparation failed: {error}"
+        logger.error(msg)
+
+    def run(self, jobs):
+        '''
+            Prepare and upload every BatchJob in jobs.
+
+            Returns:
+                list, in job order, of {'job': BatchJob, 'image_id': image_id or None, 'error': error message or None}
+        '''
+        jobs = list(jobs)
+        results = [None] * len(jobs)
+        spool_dir = self.spool_dir or tempfile.mkdtemp(prefix='upload_spdx-')
+        os.makedirs(spool_dir, exist_ok=True)
+        scheduler = UploadScheduler(self.queue_size, self.large_threshold, self.max_large_per_host, self.max_bytes_in_flight)
+        uploaders = [threading.Thread(target=self._upload_worker, args=(scheduler, results), daemon=True) 
+                     for _ in range(self.io_workers)]
+        for uploader in uploaders:
+            uploader.start()
+        try:
+            self._prepare_all(jobs, spool_dir, scheduler, results)
+        finally:
+            scheduler.close()
+            for uploader in uploaders:
+                uploader.join()
+            if not self.spool_dir:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+        return results
+
+
+class ChangeDetector:
+    '''
+        Decide which BatchJobs need their SBOM regenerated and uploaded.
+
+        A job's fingerprint is a SHA-256 over where it is uploaded, its generate command, and
+        the relative path and content hash of every file matching its inputs patterns. The
+        fingerprint is recorded in state_file after a successful upload; a job whose current
+        fingerprint matches the recorded one is skipped. Jobs without inputs, or with an inputs
+        pattern that matches no file, are never skipped.
+    '''
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        try:
+            with open(state_file, 'r') as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {}
+        except ValueError:
+            msg = f"Ignoring unreadable state file '{state_file}'"
+            logger.warning(msg)
+            self.state = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _file_sha256(path):
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    @classmethod
+    def fingerprint(cls, job):
+        ''' Fingerprint of job's inputs, or None when job has no inputs or a pattern matches no file '''
+        if not job.inputs:
+            return None
+        digest = hashlib.sha256()
+        digest.update(f'{job.key}\0{job.generate or ""}\0'.encode('utf-8'))
+        for pattern in sorted(job.inputs):
+            matches = sorted(glob.glob(os.path.join(job.base_dir, pattern), recursive=True))
+            files = [path for path in matches if os.path.isfile(path)]
+            if not files:
+                # a typo or a moved lockfile would otherwise pin the fingerprint and skip the job forever
+                msg = f"Inputs pattern '{pattern}' of '{job.spdx_file_path}' matches no file; treating it as changed"
+                logger.warning(msg)
+                return None
+            digest.update(f'{pattern}\0{len(matches)}\0'.encode('utf-8'))
+            for path in files:
+                relative_path = os.path.relpath(path, job.base_dir)
+                digest.update(f'{relative_path}\0{cls._file_sha256(path)}\0'.encode('utf-8'))
+        return digest.hexdigest()
+
+    def is_unchanged(self, job, fingerprint):
+        return fingerprint is not None and self.state.get(job.key) == fingerprint
+
+    def record(self, job, fingerprint):
+        ''' Record fingerprint as job's last successful upload and save the state file '''
+        if fingerprint is None:
+            return
+        with self._lock:
+            self.state[job.key] = fingerprint
+            tmp_path = f'{self.state_file}.tmp'
+            with open(tmp_path, 'w') as f:
+                json.dump(self.state, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.state_file)
+
+
+def generate_sbom(job):
+    ''' Run job.generate (in job.base_dir) to regenerate job.spdx_file_path; raises CoronaError on failure '''
+    if not job.generate:
+        return
+    msg = f"Generating SBOM for image '{job.image_name}': {job.generate}"
+    logger.info(msg)
+    try:
+        subprocess.run(shlex.split(job.generate), cwd=job.base_dir, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        raise CoronaError(f"SBOM generation for image '{job.image_name}' failed: {e}") from e
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='Upload an SPDX document to Corona.')
+    parser.add_argument('--targets', 
+                        default=','.join(CoronaConfig.get_targets()),
+                        help='comma-separated Corona hosts to upload to concurrently (default: CORONA_TARGETS)')
+    parser.add_argument('--dedupe', 
+                        action='store_true', 
+                        default=CoronaConfig.get_dedupe_packages(),
+                        help='de-duplicate SPDX packages by purl/CPE/name+version before upload (default: CORONA_DEDUPE_PACKAGES)')
+    parser.add_argument('--input-format', 
+                        choices=SPDX_INPUT_FORMATS, 
+                        default=CoronaConfig.get_input_format(),
+                        help='format of the SPDX file; tag-value and CycloneDX JSON are converted to SPDX JSON '
+                             'while uploading (default: CORONA_INPUT_FORMAT, or auto)')
+    subparsers = parser.add_subparsers(dest='command')
+
+    batch = subparsers.add_parser('batch', help='upload every SPDX file listed in a manifest')
+    batch.add_argument('manifest', help='JSON list of {"product", "release", "image", "spdx_file", "host" (optional)}')
+    batch.add_argument('--cpu-workers', type=int, help='SPDX preparation processes (default: number of CPUs)')
+    batch.add_argument('--io-workers', type=int, default=4, help='upload threads')
+    batch.add_argument('--queue-size', type=int, help='prepared SPDX files waiting for upload (default: 2 * io-workers)')
+    batch.add_argument('--spool-dir', help='directory for prepared SPDX files (default: a temporary directory)')
+    batch.add_argument('--large-threshold-mb', type=float, default=10, help='SPDX files of this size or more count as large uploads')
+    batch.add_argument('--max-large-per-host', type=int, default=2, help='concurrent large uploads per Corona host')
+    batch.add_argument('--max-mb-in-flight', type=float, help='cap on SPDX megabytes being uploaded at once (default: no cap)')
+    batch.add_argument('--shard-index', type=int, default=0, help='this node\'s shard, 0 .. shard-count - 1')
+    batch.add_argument('--shard-count', type=int, default=1, help='number of nodes the manifest is partitioned across')
+    batch.add_argument('--lock-dir', help='shared directory for lease files coordinating product/release/image creation')
+    batch.add_argument('--lease-ttl', type=float, default=LEASE_TTL, 
+                       help='seconds without a heartbeat after which a lease left by a crashed node is broken')
+
+    ci = subparsers.add_parser('ci', help='generate and upload only the SBOMs whose inputs changed since the last upload')
+    ci.add_argument('manifest', help='batch manifest whose entries have "inputs" patterns and a "generate" command')
+    ci.add_argument('--state-file', default=CoronaConfig.get_state_file(), 
+                    help='fingerprints of the last successful uploads (default: CORONA_STATE_FILE)')
+    ci.add_argument('--cpu-workers', type=int, help='SBOM generation/preparation processes (default: number of CPUs)')
+    ci.add_argument('--io-workers', type=int, default=4, help='upload threads')
+
+    loadgen = subparsers.add_parser('loadgen', help='upload synthetic SPDX documents to measure upload capacity')
+    loadgen.add_argument('--host', default=CoronaConfig.get_host(), 
+                         help='Corona host, or http://host:port of a stand-in server (default: CORONA_HOST)')
+    loadgen.add_argument('--image-id', help='image to upload to (default: resolve/create the configured product/release/image)')
+    loadgen.add_argument('--packages', type=int, default=285, help='packages per document')
+    loadgen.add_argument('--duplication', type=float, default=0.0, help='fraction of duplicate packages (0.0 - 1.0)')
+    loadgen.add_argument('--relationship-density', type=float, default=0.0, help='average DEPENDS_ON relationships per package')
+    loadgen.add_argument('--documents', type=int, default=4, help='distinct documents to generate and upload round-robin')
+    loadgen.add_argument('--concurrency', type=int, default=4, help='maximum uploads in flight')
+    loadgen.add_argument('--rate', type=float, help='target uploads per second (default: closed-loop at full concurrency)')
+    loadgen.add_argument('--requests', type=int, default=100, help='number of uploads to issue')
+    loadgen.add_argument('--duration', type=float, help='stop issuing uploads after this many seconds')
+    loadgen.add_argument('--interval', type=float, default=10.0, help='reporting window in seconds')
+    loadgen.add_argument('--seed', type=int, help='random seed for the synthetic documents')
+    loadgen.add_argument('--report', help='write the JSON report to this path')
+    return parser.parse_args(argv)
+
+
+def main_batch(args):
+    ''' Upload every SPDX file listed in args.manifest through the SpdxBatchPipeline '''
+    if not 0 <= args.shard_index < args.shard_count:
+        raise CoronaError(f'--shard-index must be between 0 and {args.shard_count - 1}')
+    if args.shard_count > 1 and not args.lock_dir:
+        # releases of one product land on different nodes, which would race to create the product
+        raise CoronaError('--shard-count > 1 requires --lock-dir on a filesystem shared by the nodes')
+    jobs = load_manifest(args.manifest)
+    total = len(jobs)
+    if args.shard_count > 1:
+        jobs = ShardRing(args.shard_count).select(jobs, args.shard_index)
+    msg = f"Batch: {len(jobs)}/{total} SPDX files from '{args.manifest}' (shard {args.shard_index + 1}/{args.shard_count})"
+    logger.info(msg)
+    pipeline = SpdxBatchPipeline(args.cpu_workers, args.io_workers, args.queue_size, args.spool_dir, 
+                                 args.dedupe, ResponseCache.from_config(), args.lock_dir, args.lease_ttl, 
+                                 int(args.large_threshold_mb * 1024 * 1024), args.max_large_per_host, 
+                                 int(args.max_mb_in_flight * 1024 * 1024) if args.max_mb_in_flight else None)
+    results = pipeline.run(jobs)
+    failed = [result for result in results if result['error']]
+    msg = f"Batch: {len(results) - len(failed)}/{len(results)} SPDX files added"
+    logger.info(msg)
+    if failed:
+        sys.exit(1)
+
+
+def main_ci(args):
+    ''' Generate and upload the SBOMs in args.manifest whose inputs changed since their last successful upload '''
+    jobs = load_manifest(args.manifest)
+    detector = ChangeDetector(args.state_file)
+    fingerprints = {job.key: ChangeDetector.fingerprint(job) for job in jobs}
+    changed = [job for job in jobs if not detector.is_unchanged(job, fingerprints[job.key])]
+    msg = f"CI: {len(changed)}/{len(jobs)} images have changed inputs, skipping {len(jobs) - len(changed)}"
+    logger.info(msg)
+
+    failed = []
+    generated = []
+    with ThreadPoolExecutor(max_workers=args.cpu_workers or os.cpu_count() or 1) as executor:
+        futures = {executor.submit(generate_sbom, job): job for job in changed}
+        for future in as_completed(futures):
+            try:
+                future.result()
+                generated.append(futures[future])
+            except CoronaError as e:
+                msg = f"Not uploading '{futures[future].spdx_file_path}': {e}"
+                logger.error(msg)
+                failed.append(futures[future])
+
+    pipeline = SpdxBatchPipeline(args.cpu_workers, args.io_workers, dedupe=args.dedupe, 
+                                 response_cache=ResponseCache.from_config())
+    for result in pipeline.run(generated):
+        if result['error']:
+            failed.append(result['job'])
+        else:
+            detector.record(result['job'], fingerprints[result['job'].key])
+
+    msg = f"CI: {len(changed) - len(failed)}/{len(changed)} changed SBOMs generated and added"
+    logger.info(msg)
+    if failed:
+        sys.exit(1)
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.0f}ms'
+
+
+def main_loadgen(args):
+    ''' Generate synthetic SPDX documents and upload them at the requested concurrency/rate '''
+    user_name = CoronaConfig.get_target_user_name(args.host)
+    pat = CoronaConfig.get_target_pat(args.host)
+    image_id = args.image_id
+    if not image_id:
+        image_id = CoronaUploader(args.host, user_name, pat, 
+                                  credential_pool=CredentialPool.from_config(args.host)).resolve_image(CoronaConfig.get_product_name(), 
+                                                                          CoronaConfig.get_release_version(), 
+                                                                          CoronaConfig.get_image_name())
+
+    generator = SyntheticSpdxGenerator(args.packages, args.duplication, args.relationship_density, args.seed)
+    documents = [generator.prepared(f'synthetic-{i}') for i in range(args.documents)]
+    msg = f"Load: {args.requests} uploads of {args.documents} documents ({len(documents[0].content)} bytes each) to '{args.host}' image_id {image_id}, concurrency {args.concurrency}, rate {args.rate or 'unlimited'}/s"
+    logger.info(msg)
+
+    report = LoadGenerator(args.host, user_name, pat, image_id, documents, args.concurrency, 
+                           args.rate, args.requests, args.duration, CredentialPool.from_config(args.host)).run(args.interval)
+
+    for window in report['intervals']:
+        msg = f"[{window['start']:>7.1f}s] uploads {window['uploads']}, {window['throughput']:.2f}/s, p50 {_ms(window['latency']['p50'])}, p99 {_ms(window['latency']['p99'])}, errors {window['error_rate']:.1%}, throttled {window['throttle_rate']:.1%}, max start lag {_ms(window['max_start_lag'])}"
+        logger.info(msg)
+    msg = f"Total: uploads {report['uploads']} in {report['elapsed']:.1f}s, {report['throughput']:.2f}/s, p50 {_ms(report['latency']['p50'])}, p90 {_ms(report['latency']['p90'])}, p99 {_ms(report['latency']['p99'])}, errors {report['error_rate']:.1%}, throttled {report['throttle_rate']:.1%}, max start lag {_ms(report['max_start_lag'])}"
+    logger.info(msg)
+    if report['target_rate']:
+        msg = f"Target rate {report['target_rate']:.2f}/s, achieved {report['throughput']:.2f}/s ({report['rate_achieved']:.0%})"
+        if report['rate_achieved'] < 0.95:
+            msg += '; uploads queued behind a saturated --concurrency, latencies include the wait'
+            logger.warning(msg)
+        else:
+            logger.info(msg)
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+def main_fan_out(hosts, dedupe=False, input_format='auto'):
+    ''' Read the SPDX file once and upload it to every host in hosts concurrently '''
+    spdx_file_path = CoronaConfig.get_spdx_file_path()
+    if input_format == 'auto':
+        input_format = detect_input_format(spdx_file_path)
+    if input_format != 'spdx-json':
+        # uploading anything else as spdx.json would replace each image's components with nothing
+        raise CoronaError(f"Multi-host upload takes SPDX JSON only; '{spdx_file_path}' is {input_format}")
+    product_name = CoronaConfig.get_product_name()
+    release_version = CoronaConfig.get_release_version()
+    image_name = CoronaConfig.get_image_name()
+    msg = f"Adding SPDX '{spdx_file_path}' to '{product_name}' v'{release_version}', image '{image_name}' on {len(hosts)} hosts: {', '.join(hosts)}"
+    logger.info(msg)
+
+    prepared = PreparedSpdx.from_file(spdx_file_path, dedupe=dedupe, validate=True)
+    targets = [(host, CoronaConfig.get_target_user_name(host), CoronaConfig.get_target_pat(host)) for host in hosts]
+    results = fan_out_upload(targets, product_name, release_version, image_name, prepared, 
+                             response_cache=ResponseCache.from_config())
+
+    failed = [host for host in hosts if results[host]['error']]
+    msg = f"SPDX added on {len(hosts) - len(failed)}/{len(hosts)} hosts" + (f", failed: {', '.join(failed)}" if failed else '')
+    logger.info(msg)
+    if failed:
+        sys.exit(1)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    commands = {'batch': main_batch, 'ci': main_ci, 'loadgen': main_loadgen}
+    if args.command in commands:
+        try:
+            commands[args.command](args)
+        except CoronaError as e:
+            msg = f"{args.command}: {e}"
+            logger.fatal(msg)
+            sys.exit(1)
+        return
+
+    hosts = [host.strip() for host in args.targets.split(',') if host.strip()]
+    if hosts:
+        try:
+            main_fan_out(hosts, dedupe=args.dedupe, input_format=args.input_format)
+        except CoronaError as e:
+            msg = f"Fan-out upload failed: {e}"
+            logger.fatal(msg)
+            sys.exit(1)
+        return
 
-def main():
     try:
         # Configurations 
         host = CoronaConfig.get_host()
         user_name = CoronaConfig.get_user_name()
 
         # Initialize managers
-        product_manager = ProductManager(host, user_name)
-        release_manager = ReleaseManager(host, user_name)
-        image_manager = ImageManager(host, user_name)
-        spdx_manager = SpdxManager(host, user_name)
+        uploader = CoronaUploader(host, user_name, response_cache=ResponseCache.from_config(), 
+                                  credential_pool=CredentialPool.from_config(host))
 
         msg = f"Adding SPDX '{CoronaConfig.get_spdx_file_path()}' to '{CoronaConfig.get_product_name()}' v'{CoronaConfig.get_release_version()}', image '{CoronaConfig.get_image_name()}')\n"
         logger.info(msg)
 
-        # Operations
-        product_id = product_manager.get_or_create_product(CoronaConfig.get_product_name())
-        release_id = release_manager.get_or_create_release(product_id, CoronaConfig.get_release_version())
-        image_id = image_manager.get_or_create_image(product_id, release_id, CoronaConfig.get_image_name())
-        spdx_response = spdx_manager.update_or_add_spdx(image_id, CoronaConfig.get_spdx_file_path())
+        # Operations: tag-value and CycloneDX inputs are converted while they stream into the upload
+        spdx_file_path = CoronaConfig.get_spdx_file_path()
+        chunks = spdx_json_stream(spdx_file_path, args.input_format)
+        if chunks is not None:
+            if args.dedupe:
+                msg = f"--dedupe applies to SPDX JSON input only; uploading '{spdx_file_path}' converted as is"
+                logger.warning(msg)
+            image_id = uploader.resolve_image(CoronaConfig.get_product_name(), 
+                                              CoronaConfig.get_release_version(), 
+                                              CoronaConfig.get_image_name())
+            file_name = os.path.splitext(os.path.basename(spdx_file_path))[0] + '.spdx.json'
+            uploader.spdx_manager.upload_spdx_stream(image_id, file_name, chunks)
+            msg = f"SPDX added to '{CoronaConfig.get_product_name()}' v'{CoronaConfig.get_release_version()}', image '{CoronaConfig.get_image_name()}' ({image_id}) successfully.\n"
+            logger.info(msg)
+            return
+
+        # read, validate and hash (and de-duplicate) the SPDX file while the
+        # sign-in and product/release/image chain run, then upload as soon as the image is known
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            prepare_future = executor.submit(PreparedSpdx.from_file, spdx_file_path, args.dedupe, True)
+            image_id = uploader.resolve_image(CoronaConfig.get_product_name(), 
+                                              CoronaConfig.get_release_version(), 
+                                              CoronaConfig.get_image_name())
+            prepared = prepare_future.result()
+        msg = f"SPDX '{prepared.file_name}' prepared: {len(prepared.content)} bytes, sha256 {prepared.sha256}"
+        logger.info(msg)
+        spdx_response = uploader.spdx_manager.upload_prepared_spdx(image_id, prepared)
 
         msg = f"SPDX added to '{CoronaConfig.get_product_name()}' v'{CoronaConfig.get_release_version()}', image '{CoronaConfig.get_image_name()}' ({image_id}) successfully.\n"
         logger.info(msg)
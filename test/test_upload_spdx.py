@@ -6,6 +6,13 @@ __email__ = 'tedg@cisco.com'
 __version__ = '1.0.0'
 import pytest
 import os
+import io
+import re
+import json
+import sys
+import time
+import shutil
+import threading
 import requests
 from unittest import mock
 from unittest.mock import mock_open
@@ -18,6 +25,31 @@ from upload_spdx import (
     ReleaseManager,
     ImageManager,
     SpdxManager,
+    PreparedSpdx,
+    ResponseCache,
+    SpdxDeduplicator,
+    CoronaUploader,
+    main,
+    fan_out_upload,
+    SyntheticSpdxGenerator,
+    LoadGenerator,
+    percentile,
+    BatchJob,
+    load_manifest,
+    prepare_spdx_artifact,
+    SpdxBatchPipeline,
+    ShardRing,
+    LeaseLock,
+    UploadScheduler,
+    ServiceAccount,
+    CredentialPool,
+    ChangeDetector,
+    generate_sbom,
+    TagValueSpdxConverter,
+    CycloneDxSpdxConverter,
+    _JsonStreamReader,
+    detect_input_format,
+    spdx_json_stream,
 )
 
 # Constants for testing
@@ -188,6 +220,91 @@ class TestCoronaAPIClient:
         mock_exit.assert_called_once_with(500)
 
 
+# Test ResponseCache and its use by make_authenticated_request
+class TestResponseCache:
+    @pytest.fixture(params=['memory', 'disk'])
+    def response_cache(self, request, tmp_path):
+        if request.param == 'disk':
+            # a fresh memory tier on every lookup forces reads through the disk tier
+            return ResponseCache(max_entries=0, cache_dir=str(tmp_path))
+        return ResponseCache()
+
+    @pytest.fixture
+    def api_client(self, response_cache):
+        return CoronaAPIClient(host=HOST, user_name=USERNAME, response_cache=response_cache)
+
+    def test_resource_of(self):
+        assert ResponseCache.resource_of('api/v2/releases?product_id=1') == 'releases'
+        assert ResponseCache.resource_of('api/v1/releases') == 'releases'
+        assert ResponseCache.resource_of(f'api/v2/images/{IMAGE_ID}/spdx.json') == 'images'
+
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='test_token')
+    @mock.patch('requests.request')
+    def test_get_revalidates_with_etag(self, mock_request, mock_get_auth_token, api_client):
+        listing = {'data': [{'id': PRODUCT_ID}]}
+        mock_request.side_effect = [
+            mock.Mock(status_code=200, headers={'ETag': '"v1"'}, json=lambda: listing),
+            mock.Mock(status_code=304, headers={}, json=mock.Mock(side_effect=ValueError)),
+        ]
+
+        assert api_client.make_authenticated_request('GET', 'api/v2/products?name=p') == listing
+        assert api_client.make_authenticated_request('GET', 'api/v2/products?name=p') == listing
+
+        assert 'If-None-Match' not in mock_request.call_args_list[0][1]['headers']
+        assert mock_request.call_args_list[1][1]['headers']['If-None-Match'] == '"v1"'
+
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='test_token')
+    @mock.patch('requests.request')
+    def test_response_without_validators_not_cached(self, mock_request, mock_get_auth_token, api_client):
+        mock_request.return_value = mock.Mock(status_code=200, headers={}, json=lambda: {'data': []})
+
+        api_client.make_authenticated_request('GET', 'api/v2/products?name=p')
+        api_client.make_authenticated_request('GET', 'api/v2/products?name=p')
+
+        assert 'If-None-Match' not in mock_request.call_args_list[1][1]['headers']
+        assert 'If-Modified-Since' not in mock_request.call_args_list[1][1]['headers']
+
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='test_token')
+    @mock.patch('requests.request')
+    def test_write_invalidates_resource_listings(self, mock_request, mock_get_auth_token, api_client):
+        mock_request.side_effect = [
+            mock.Mock(status_code=200, headers={'Last-Modified': 'Mon, 01 Jan 2024 00:00:00 GMT'}, json=lambda: {'data': []}),
+            mock.Mock(status_code=200, headers={'ETag': '"p"'}, json=lambda: {'data': []}),
+            mock.Mock(status_code=200, headers={}, json=lambda: {'id': RELEASE_ID}),
+            mock.Mock(status_code=200, headers={}, json=lambda: {'data': [{'id': RELEASE_ID}]}),
+            mock.Mock(status_code=304, headers={}),
+        ]
+
+        api_client.make_authenticated_request('GET', f'api/v2/releases?product_id={PRODUCT_ID}')
+        api_client.make_authenticated_request('GET', 'api/v2/products?name=p')
+        api_client.make_authenticated_request('POST', 'api/v1/releases', {'release': {}})
+        assert api_client.make_authenticated_request('GET', f'api/v2/releases?product_id={PRODUCT_ID}') == {'data': [{'id': RELEASE_ID}]}
+        api_client.make_authenticated_request('GET', 'api/v2/products?name=p')
+
+        assert 'If-Modified-Since' not in mock_request.call_args_list[3][1]['headers']
+        assert mock_request.call_args_list[4][1]['headers']['If-None-Match'] == '"p"'
+
+    def test_sub_resource_write_keeps_listings(self, tmp_path):
+        cache = ResponseCache(cache_dir=str(tmp_path))
+        url = f'https://{HOST}/api/v2/images?release_id={RELEASE_ID}'
+        cache.store(HOST, f'api/v2/images?release_id={RELEASE_ID}', url, {'ETag': '"i"'}, {'data': []})
+
+        cache.invalidate(HOST, f'api/v2/images/{IMAGE_ID}/spdx.json')
+        assert ResponseCache(cache_dir=str(tmp_path)).get(HOST, f'api/v2/images?release_id={RELEASE_ID}', url)['etag'] == '"i"'
+
+        cache.invalidate(HOST, 'api/v2/images')
+        assert ResponseCache(cache_dir=str(tmp_path)).get(HOST, f'api/v2/images?release_id={RELEASE_ID}', url) is None
+        assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
+
+    def test_memory_tier_is_lru(self):
+        cache = ResponseCache(max_entries=2)
+        for name in ('a', 'b', 'c'):
+            cache.store(HOST, f'api/v2/products?name={name}', name, {'ETag': name}, name)
+
+        assert cache.get(HOST, 'api/v2/products?name=a', 'a') is None
+        assert cache.get(HOST, 'api/v2/products?name=c', 'c')['body'] == 'c'
+
+
 # Test ProductManager
 class TestProductManager:
     @pytest.fixture
@@ -538,3 +655,1150 @@ class TestSpdxManager:
 
         # Assert response is as expected
         assert response == {"unexpected_key": "unexpected_value"}
+
+
+# Test PreparedSpdx and SpdxManager.upload_prepared_spdx
+class TestPreparedSpdx:
+    def test_from_file(self, tmp_path):
+        spdx_file = tmp_path / 'test.spdx.json'
+        spdx_file.write_bytes(b'{"spdxVersion": "SPDX-2.3"}')
+
+        prepared = PreparedSpdx.from_file(str(spdx_file))
+
+        assert prepared.file_name == 'test.spdx.json'
+        assert prepared.content == b'{"spdxVersion": "SPDX-2.3"}'
+        assert prepared.text == '{"spdxVersion": "SPDX-2.3"}'
+
+    def test_from_file_not_found(self, tmp_path):
+        with pytest.raises(CoronaError, match="not found"):
+            PreparedSpdx.from_file(str(tmp_path / 'missing.json'))
+
+    @mock.patch.object(SpdxManager, 'make_authenticated_request')
+    def test_upload_prepared_spdx(self, mock_make_authenticated_request):
+        mock_make_authenticated_request.return_value = {"status": "success"}
+        prepared = PreparedSpdx('test.spdx.json', b'content')
+
+        response = SpdxManager(HOST, USERNAME).upload_prepared_spdx(IMAGE_ID, prepared)
+
+        mock_make_authenticated_request.assert_any_call(
+            'POST',
+            f'api/v2/images/{IMAGE_ID}/spdx.json',
+            data=dict(SpdxManager.UPLOAD_OPTIONS, data='content')
+        )
+        mock_make_authenticated_request.assert_any_call(
+            'POST',
+            f'api/v2/images/{IMAGE_ID}/spdx.json',
+            files={'data': ('test.spdx.json', b'content')}
+        )
+        assert response == {"status": "success"}
+
+
+# Test SpdxDeduplicator
+def _package(spdx_id, name, version, purl=None, cpe=None):
+    refs = []
+    if cpe:
+        refs.append({'referenceCategory': 'SECURITY', 'referenceType': 'cpe23Type', 'referenceLocator': cpe})
+    if purl:
+        refs.append({'referenceCategory': 'PACKAGE-MANAGER', 'referenceType': 'purl', 'referenceLocator': purl})
+    return {'name': name, 'SPDXID': spdx_id, 'versionInfo': version, 'externalRefs': refs}
+
+
+class TestSpdxDeduplicator:
+    def test_package_key_precedence(self):
+        assert SpdxDeduplicator.package_key(_package('a', 'x', '1', purl='pkg:cargo/x@1', cpe='cpe:x')) == 'purl:pkg:cargo/x@1'
+        assert SpdxDeduplicator.package_key(_package('a', 'x', '1', cpe='cpe:x')) == 'cpe23Type:cpe:x'
+        assert SpdxDeduplicator.package_key(_package('a', 'x', '1')) == 'name:x@1'
+
+    def test_deduplicate_merges_packages_and_rewrites_relationships(self):
+        spdx_doc = {
+            'documentDescribes': ['SPDXRef-A', 'SPDXRef-A2'],
+            'packages': [
+                _package('SPDXRef-A', 'a', '1.0', purl='pkg:cargo/a@1.0', cpe='cpe:2.3:a:a:a:1.0'),
+                _package('SPDXRef-B', 'b', '2.0'),
+                _package('SPDXRef-A2', 'a', '1.0', purl='pkg:cargo/a@1.0', cpe='cpe:2.3:a:other:a:1.0'),
+                _package('SPDXRef-B2', 'b', '2.0'),
+            ],
+            'relationships': [
+                {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 'relatedSpdxElement': 'SPDXRef-A'},
+                {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 'relatedSpdxElement': 'SPDXRef-A2'},
+                {'spdxElementId': 'SPDXRef-A2', 'relationshipType': 'DEPENDS_ON', 'relatedSpdxElement': 'SPDXRef-B2'},
+                {'spdxElementId': 'SPDXRef-A', 'relationshipType': 'DEPENDS_ON', 'relatedSpdxElement': 'SPDXRef-A2'},
+            ],
+        }
+        deduplicator = SpdxDeduplicator()
+
+        deduplicator.deduplicate(spdx_doc)
+
+        assert [p['SPDXID'] for p in spdx_doc['packages']] == ['SPDXRef-A', 'SPDXRef-B']
+        assert [r['referenceLocator'] for r in spdx_doc['packages'][0]['externalRefs']] == [
+            'cpe:2.3:a:a:a:1.0', 'pkg:cargo/a@1.0', 'cpe:2.3:a:other:a:1.0'
+        ]
+        assert spdx_doc['documentDescribes'] == ['SPDXRef-A']
+        assert spdx_doc['relationships'] == [
+            {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 'relatedSpdxElement': 'SPDXRef-A'},
+            {'spdxElementId': 'SPDXRef-A', 'relationshipType': 'DEPENDS_ON', 'relatedSpdxElement': 'SPDXRef-B'},
+        ]
+        assert deduplicator.packages_removed == 2
+        assert deduplicator.relationships_removed == 2
+
+    def test_prepared_spdx_dedupe(self, tmp_path):
+        spdx_file = tmp_path / 'test.spdx.json'
+        spdx_file.write_text(json.dumps({'packages': [_package('SPDXRef-A', 'a', '1'), _package('SPDXRef-A2', 'a', '1')]}))
+
+        prepared = PreparedSpdx.from_file(str(spdx_file), dedupe=True)
+
+        assert [p['SPDXID'] for p in json.loads(prepared.content)['packages']] == ['SPDXRef-A']
+
+    def test_prepared_spdx_dedupe_invalid_json(self, tmp_path):
+        spdx_file = tmp_path / 'test.spdx.json'
+        spdx_file.write_text('not json')
+
+        with pytest.raises(CoronaError, match='not valid JSON'):
+            PreparedSpdx.from_file(str(spdx_file), dedupe=True)
+
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx', return_value={"status": "success"})
+    def test_update_or_add_spdx_dedupe(self, mock_upload_prepared_spdx, tmp_path):
+        spdx_file = tmp_path / 'test.spdx.json'
+        spdx_file.write_text(json.dumps({'packages': [_package('SPDXRef-A', 'a', '1'), _package('SPDXRef-A2', 'a', '1')]}))
+
+        response = SpdxManager(HOST, USERNAME).update_or_add_spdx(IMAGE_ID, str(spdx_file), dedupe=True)
+
+        prepared = mock_upload_prepared_spdx.call_args[0][1]
+        assert len(json.loads(prepared.content)['packages']) == 1
+        assert response == {"status": "success"}
+
+
+# Test fan_out_upload
+class TestFanOutUpload:
+    @mock.patch.object(CoronaUploader, 'upload', return_value=IMAGE_ID)
+    def test_fan_out_upload_all_hosts(self, mock_upload):
+        targets = [('stage.example.com', USERNAME, PAT), ('prod.example.com', USERNAME, PAT)]
+        prepared = PreparedSpdx('test.spdx.json', b'content')
+
+        results = fan_out_upload(targets, PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, prepared)
+
+        assert results == {
+            'stage.example.com': {'image_id': IMAGE_ID, 'error': None},
+            'prod.example.com': {'image_id': IMAGE_ID, 'error': None},
+        }
+        assert mock_upload.call_count == 2
+        mock_upload.assert_called_with(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, prepared)
+
+    def test_fan_out_upload_uses_per_host_credentials(self):
+        targets = [('stage.example.com', 'stage_user', 'stage_pat'), ('prod.example.com', 'prod_user', 'prod_pat')]
+        seen = {}
+
+        def fake_upload(uploader, *args):
+            seen[uploader.host] = (uploader.spdx_manager.user_name, uploader.spdx_manager.pat)
+            return IMAGE_ID
+
+        with mock.patch.object(CoronaUploader, 'upload', autospec=True, side_effect=fake_upload):
+            fan_out_upload(targets, PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, PreparedSpdx('f', b''))
+
+        assert seen == {
+            'stage.example.com': ('stage_user', 'stage_pat'),
+            'prod.example.com': ('prod_user', 'prod_pat'),
+        }
+
+    def test_fan_out_upload_reports_failed_hosts(self):
+        targets = [('stage.example.com', USERNAME, PAT), ('prod.example.com', USERNAME, PAT), ('dev.example.com', USERNAME, PAT)]
+
+        def fake_upload(uploader, *args):
+            if uploader.host == 'stage.example.com':
+                raise CoronaError('Failed to perform request')
+            if uploader.host == 'dev.example.com':
+                raise SystemExit(401)
+            return IMAGE_ID
+
+        with mock.patch.object(CoronaUploader, 'upload', autospec=True, side_effect=fake_upload):
+            results = fan_out_upload(targets, PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, PreparedSpdx('f', b''))
+
+        assert results['prod.example.com'] == {'image_id': IMAGE_ID, 'error': None}
+        assert results['stage.example.com'] == {'image_id': None, 'error': 'Failed to perform request'}
+        assert results['dev.example.com'] == {'image_id': None, 'error': 'HTTP error 401'}
+
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='token')
+    def test_fan_out_upload_contains_non_json_error_body(self, mock_get_auth_token):
+        targets = [('stage.example.com', USERNAME, PAT), ('prod.example.com', USERNAME, PAT)]
+        upload = CoronaUploader.upload
+        # a proxy in front of stage answers with an HTML 403 page
+        forbidden = mock.Mock(status_code=403, text='<html>Forbidden</html>', 
+                              raise_for_status=mock.Mock(side_effect=requests.exceptions.HTTPError()), 
+                              json=mock.Mock(side_effect=requests.exceptions.JSONDecodeError('Expecting value', '<html>', 0)))
+
+        def fake_upload(uploader, *args):
+            if uploader.host == 'prod.example.com':
+                return IMAGE_ID
+            return upload(uploader, *args)
+
+        with mock.patch.object(CoronaUploader, 'upload', autospec=True, side_effect=fake_upload), \
+             mock.patch.object(requests.Session, 'request', return_value=forbidden):
+            results = fan_out_upload(targets, PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, PreparedSpdx('f', b''))
+
+        assert results['prod.example.com'] == {'image_id': IMAGE_ID, 'error': None}
+        assert results['stage.example.com']['image_id'] is None
+        assert results['stage.example.com']['error'].startswith('JSONDecodeError')
+
+    @pytest.mark.parametrize('input_format', ['auto', 'spdx-tv', 'spdx-json'])
+    @mock.patch.object(CoronaUploader, 'upload')
+    def test_main_fan_out_rejects_non_spdx_json(self, mock_upload, input_format, tmp_path):
+        spdx_file = tmp_path / 'image.spdx'
+        spdx_file.write_text(TAG_VALUE_SPDX)
+
+        with mock.patch.dict(os.environ, {'CORONA_SPDX_FILE_PATH': str(spdx_file)}), pytest.raises(SystemExit):
+            main(['--targets', 'stage.example.com,prod.example.com', '--input-format', input_format])
+
+        mock_upload.assert_not_called()
+
+
+def test_corona_config_targets():
+    with mock.patch.dict(os.environ, {
+        'CORONA_TARGETS': 'stage.example.com, prod.example.com',
+        'CORONA_USERNAME': USERNAME,
+        'CORONA_PAT': PAT,
+        'CORONA_PAT_STAGE_EXAMPLE_COM': 'stage_pat',
+    }):
+        assert CoronaConfig.get_targets() == ['stage.example.com', 'prod.example.com']
+        assert CoronaConfig.get_target_pat('stage.example.com') == 'stage_pat'
+        assert CoronaConfig.get_target_pat('prod.example.com') == PAT
+        assert CoronaConfig.get_target_user_name('stage.example.com') == USERNAME
+
+
+def test_corona_config_spdx_file_path():
+    with mock.patch.dict(os.environ, {'CORONA_SPDX_FILE_PATH': './image.spdx.json', 'CORONA_PRODUCT_NAME': 'product'}):
+        assert CoronaConfig.get_spdx_file_path() == './image.spdx.json'
+        assert CoronaConfig.get_product_name() == 'product'
+
+
+# Test SyntheticSpdxGenerator and LoadGenerator
+class TestSyntheticSpdxGenerator:
+    def test_generate_models_syft_output(self):
+        spdx_doc = SyntheticSpdxGenerator(package_count=50, seed=1).generate('synthetic')
+
+        assert spdx_doc['spdxVersion'] == 'SPDX-2.3'
+        assert len(spdx_doc['packages']) == 51    # plus the document root package
+        assert len(spdx_doc['relationships']) == 1 + 2 * 50
+        assert spdx_doc['packages'][-1]['SPDXID'] == 'SPDXRef-DocumentRoot-Directory-synthetic'
+
+    def test_generate_duplication_and_relationship_density(self):
+        spdx_doc = SyntheticSpdxGenerator(package_count=1000, duplication=0.3, relationship_density=2.0, seed=1).generate()
+
+        purls = [p['externalRefs'][1]['referenceLocator'] for p in spdx_doc['packages'] if 'externalRefs' in p]
+        assert 0.2 < 1 - len(set(purls)) / len(purls) < 0.4
+        depends_on = [r for r in spdx_doc['relationships'] if r['relationshipType'] == 'DEPENDS_ON']
+        assert 1800 < len(depends_on) <= 2000
+
+    def test_generate_is_reproducible_with_seed(self):
+        first = SyntheticSpdxGenerator(package_count=10, seed=7).generate()
+        second = SyntheticSpdxGenerator(package_count=10, seed=7).generate()
+        assert first['packages'] == second['packages']
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([3], 90) == 3
+    assert percentile([], 50) is None
+
+
+class TestLoadGenerator:
+    @pytest.fixture
+    def documents(self):
+        return [SyntheticSpdxGenerator(package_count=5, seed=1).prepared()]
+
+    def test_run_closed_loop(self, documents):
+        outcomes = iter([None, CoronaError('Failed'), None, None, None, SystemExit(500)] + [None] * 4)
+
+        def fake_upload(spdx_manager, image_id, prepared):
+            outcome = next(outcomes)
+            if outcome:
+                raise outcome
+
+        with mock.patch.object(SpdxManager, 'upload_prepared_spdx', autospec=True, side_effect=fake_upload) as mock_upload:
+            report = LoadGenerator(HOST, USERNAME, PAT, IMAGE_ID, documents, concurrency=1, total=10).run()
+
+        assert mock_upload.call_count == 10
+        assert report['uploads'] == 10
+        assert report['error_rate'] == 0.2
+        assert report['latency']['p50'] is not None
+        assert report['intervals'][0]['uploads'] == 10
+
+    def test_run_counts_throttled_uploads(self, documents):
+        def fake_upload(spdx_manager, image_id, prepared):
+            spdx_manager.throttled_requests += 1
+
+        with mock.patch.object(SpdxManager, 'upload_prepared_spdx', autospec=True, side_effect=fake_upload):
+            report = LoadGenerator(HOST, USERNAME, PAT, IMAGE_ID, documents, concurrency=2, total=4).run()
+
+        assert report['throttle_rate'] == 1.0
+
+    @pytest.mark.parametrize('rate', [None, 1000])
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='token')
+    def test_run_counts_non_json_error_bodies(self, mock_get_auth_token, rate, documents):
+        # a proxy rejects the upload with an HTML 413 page
+        too_large = mock.Mock(status_code=413, text='<html>Request Entity Too Large</html>', 
+                              raise_for_status=mock.Mock(side_effect=requests.exceptions.HTTPError()), 
+                              json=mock.Mock(side_effect=requests.exceptions.JSONDecodeError('Expecting value', '<html>', 0)))
+
+        with mock.patch('requests.request', return_value=too_large):
+            report = LoadGenerator(HOST, USERNAME, PAT, IMAGE_ID, documents, concurrency=2, rate=rate, total=4).run()
+
+        assert report['uploads'] == 4
+        assert report['error_rate'] == 1.0
+
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_run_at_target_rate(self, mock_upload, documents):
+        started = time.monotonic()
+        report = LoadGenerator(HOST, USERNAME, PAT, IMAGE_ID, documents, concurrency=2, rate=50, total=5).run()
+
+        assert mock_upload.call_count == 5
+        assert time.monotonic() - started >= 4 / 50
+        assert report['uploads'] == 5
+        assert report['target_rate'] == 50
+
+    def test_rate_latency_includes_queueing(self, documents):
+        # one worker, 50 ms uploads and 100 uploads/s scheduled: the uploads queue up behind each other
+        with mock.patch.object(SpdxManager, 'upload_prepared_spdx', side_effect=lambda *args: time.sleep(0.05)):
+            report = LoadGenerator(HOST, USERNAME, PAT, IMAGE_ID, documents, concurrency=1, rate=100, total=10).run()
+
+        # the last upload was due at 90 ms but only started after the 9 before it, ~450 ms in
+        assert report['latency']['max'] >= 0.4
+        assert report['max_start_lag'] >= 0.3
+        assert report['rate_achieved'] < 0.5
+
+
+# Test batch manifest, prepare_spdx_artifact and SpdxBatchPipeline
+def _write_spdx(path, packages=1):
+    path.write_text(json.dumps(SyntheticSpdxGenerator(package_count=packages, seed=1).generate(), indent=2))
+    return str(path)
+
+
+def test_load_manifest(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([
+        {'product': PRODUCT_NAME, 'release': RELEASE_VERSION, 'image': IMAGE_NAME, 'spdx_file': 'a.json'},
+        {'product': PRODUCT_NAME, 'release': RELEASE_VERSION, 'image': 'other', 'spdx_file': '/abs/b.json', 'host': 'stage.example.com'},
+    ]))
+
+    with mock.patch.dict(os.environ, {'CORONA_HOST': HOST}):
+        jobs = load_manifest(str(manifest))
+
+    assert [(j.host, j.image_name, j.spdx_file_path) for j in jobs] == [
+        (HOST, IMAGE_NAME, str(tmp_path / 'a.json')),
+        ('stage.example.com', 'other', '/abs/b.json'),
+    ]
+
+
+def test_load_manifest_missing_fields(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([{'product': PRODUCT_NAME}]))
+
+    with pytest.raises(CoronaError, match='need product, release, image and spdx_file'):
+        load_manifest(str(manifest))
+
+
+def test_prepare_spdx_artifact(tmp_path):
+    spdx_file = _write_spdx(tmp_path / 'a.spdx.json', packages=3)
+    spool_dir = tmp_path / 'spool'
+    spool_dir.mkdir()
+
+    artifact = prepare_spdx_artifact(spdx_file, str(spool_dir))
+
+    prepared = artifact.load()
+    assert prepared.file_name == 'a.spdx.json'
+    assert json.loads(prepared.content) == json.loads((tmp_path / 'a.spdx.json').read_text())
+    assert artifact.size == len(prepared.content) < os.path.getsize(spdx_file)
+    artifact.discard()
+    assert os.listdir(spool_dir) == []
+
+
+def test_prepare_spdx_artifact_packages_not_a_list(tmp_path):
+    spdx_file = tmp_path / 'a.json'
+    spdx_file.write_text('{"spdxVersion": "SPDX-2.3", "packages": {"name": "openssl"}}')
+
+    with pytest.raises(CoronaError, match="'packages' is not a list"):
+        prepare_spdx_artifact(str(spdx_file), str(tmp_path))
+
+
+def test_prepare_spdx_artifact_not_spdx(tmp_path):
+    spdx_file = tmp_path / 'a.json'
+    spdx_file.write_text('{"name": "not spdx"}')
+
+    with pytest.raises(CoronaError, match='no spdxVersion'):
+        prepare_spdx_artifact(str(spdx_file), str(tmp_path))
+
+
+class TestSpdxBatchPipeline:
+    @mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_run(self, mock_upload_prepared_spdx, mock_resolve_image, tmp_path):
+        jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, f'image-{i}', _write_spdx(tmp_path / f'{i}.json'), HOST) for i in range(5)]
+        jobs.append(BatchJob(PRODUCT_NAME, RELEASE_VERSION, 'missing', str(tmp_path / 'missing.json'), HOST))
+        spool_dir = tmp_path / 'spool'
+
+        results = SpdxBatchPipeline(cpu_workers=2, io_workers=2, queue_size=1, spool_dir=str(spool_dir)).run(jobs)
+
+        assert [result['job'] for result in results] == jobs
+        assert [result['image_id'] for result in results] == [IMAGE_ID] * 5 + [None]
+        assert 'not found' in results[-1]['error']
+        assert mock_upload_prepared_spdx.call_count == 5
+        assert sorted(call[0][2] for call in mock_resolve_image.call_args_list) == [f'image-{i}' for i in range(5)]
+        assert os.listdir(spool_dir) == []
+
+    @mock.patch.object(CoronaUploader, 'resolve_image', side_effect=SystemExit(422))
+    def test_run_upload_failure(self, mock_resolve_image, tmp_path):
+        jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, _write_spdx(tmp_path / 'a.json'), HOST)]
+
+        results = SpdxBatchPipeline(cpu_workers=1, io_workers=1).run(jobs)
+
+        assert results[0]['error'] == 'HTTP error 422'
+
+    @mock.patch.object(CoronaUploader, 'resolve_image', side_effect=TypeError('string indices must be integers'))
+    def test_run_unexpected_upload_exception(self, mock_resolve_image, tmp_path):
+        # more jobs than queue slots: the single upload thread has to survive every failure
+        jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, f'image-{i}', _write_spdx(tmp_path / f'{i}.json'), HOST) for i in range(4)]
+
+        results = SpdxBatchPipeline(cpu_workers=1, io_workers=1, queue_size=1).run(jobs)
+
+        assert [result['error'] for result in results] == ['TypeError: string indices must be integers'] * 4
+        assert mock_resolve_image.call_count == 4
+
+    @mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_run_malformed_sbom_with_dedupe(self, mock_upload_prepared_spdx, mock_resolve_image, tmp_path):
+        jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, f'image-{i}', _write_spdx(tmp_path / f'{i}.json'), HOST) for i in range(3)]
+        not_objects = tmp_path / 'not_objects.json'
+        not_objects.write_text(json.dumps({'spdxVersion': 'SPDX-2.3', 'packages': ['openssl']}))
+        bad_refs = tmp_path / 'bad_refs.json'
+        bad_refs.write_text(json.dumps({'spdxVersion': 'SPDX-2.3', 'packages': [{'name': 'a', 'externalRefs': 'purl'}]}))
+        jobs += [BatchJob(PRODUCT_NAME, RELEASE_VERSION, name, str(tmp_path / f'{name}.json'), HOST) for name in ('not_objects', 'bad_refs')]
+
+        results = SpdxBatchPipeline(cpu_workers=1, io_workers=1, dedupe=True).run(jobs)
+
+        assert [result['image_id'] for result in results] == [IMAGE_ID] * 3 + [None, None]
+        assert results[3]['error'] == "SPDX 'packages' must be a list of objects to de-duplicate."
+        assert results[4]['error'].startswith('AttributeError')
+        assert mock_upload_prepared_spdx.call_count == 3
+
+
+# Test ChangeDetector, generate_sbom and the ci command
+class TestChangeDetector:
+    @pytest.fixture
+    def job(self, tmp_path):
+        (tmp_path / 'svc').mkdir()
+        (tmp_path / 'svc' / 'Cargo.lock').write_text('lock v1')
+        (tmp_path / 'svc' / 'Dockerfile').write_text('FROM scratch')
+        return BatchJob(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, str(tmp_path / 'svc.json'), HOST, 
+                        inputs=['svc/Cargo.lock', 'svc/**/Dockerfile'], generate='syft dir:svc', base_dir=str(tmp_path))
+
+    def test_fingerprint_follows_input_content(self, job, tmp_path):
+        before = ChangeDetector.fingerprint(job)
+        assert ChangeDetector.fingerprint(job) == before
+
+        (tmp_path / 'svc' / 'Cargo.lock').write_text('lock v2')
+        assert ChangeDetector.fingerprint(job) != before
+
+    def test_fingerprint_is_independent_of_checkout_location(self, job, tmp_path):
+        before = ChangeDetector.fingerprint(job)
+        shutil.copytree(tmp_path / 'svc', tmp_path / 'elsewhere' / 'svc')
+        job.base_dir = str(tmp_path / 'elsewhere')
+
+        assert ChangeDetector.fingerprint(job) == before
+
+    def test_fingerprint_without_inputs(self, job):
+        job.inputs = []
+        assert ChangeDetector.fingerprint(job) is None
+
+    def test_pattern_matching_no_file_is_always_changed(self, job, tmp_path, caplog):
+        state_file = str(tmp_path / 'state.json')
+        job.inputs = ['svc/Cargo.lock', 'svc/Cargo.lokc']
+
+        fingerprint = ChangeDetector.fingerprint(job)
+        ChangeDetector(state_file).record(job, fingerprint)
+
+        assert fingerprint is None
+        assert not ChangeDetector(state_file).is_unchanged(job, ChangeDetector.fingerprint(job))
+        assert "'svc/Cargo.lokc'" in caplog.text
+
+    def test_record_and_reload(self, job, tmp_path):
+        state_file = str(tmp_path / 'state.json')
+        fingerprint = ChangeDetector.fingerprint(job)
+        assert not ChangeDetector(state_file).is_unchanged(job, fingerprint)
+
+        ChangeDetector(state_file).record(job, fingerprint)
+
+        assert ChangeDetector(state_file).is_unchanged(job, fingerprint)
+        assert not ChangeDetector(state_file).is_unchanged(job, None)
+
+
+def test_generate_sbom(tmp_path):
+    job = BatchJob(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, str(tmp_path / 'out.json'), HOST, 
+                   generate=f"{sys.executable} -c \"open('out.json', 'w').write('{{}}')\"", base_dir=str(tmp_path))
+
+    generate_sbom(job)
+
+    assert (tmp_path / 'out.json').read_text() == '{}'
+
+
+def test_generate_sbom_failure(tmp_path):
+    job = BatchJob(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME, 'out.json', HOST, 
+                   generate=f'{sys.executable} -c "raise SystemExit(3)"', base_dir=str(tmp_path))
+
+    with pytest.raises(CoronaError, match='SBOM generation'):
+        generate_sbom(job)
+
+
+@mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+@mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+def test_ci_uploads_only_changed_images(mock_upload_prepared_spdx, mock_resolve_image, tmp_path):
+    for name in ('api', 'web'):
+        (tmp_path / f'{name}.lock').write_text(f'{name} v1')
+    _write_spdx(tmp_path / 'template.json')
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text(json.dumps([
+        {'product': PRODUCT_NAME, 'release': RELEASE_VERSION, 'image': name, 'spdx_file': f'{name}.spdx.json', 
+         'inputs': [f'{name}.lock'], 
+         'generate': f"{sys.executable} -c \"import shutil; shutil.copy('template.json', '{name}.spdx.json')\""} 
+        for name in ('api', 'web')
+    ]))
+    args = ['ci', str(manifest), '--state-file', str(tmp_path / 'state.json'), '--cpu-workers', '1']
+
+    main(args)
+    assert mock_upload_prepared_spdx.call_count == 2
+
+    main(args)
+    assert mock_upload_prepared_spdx.call_count == 2
+
+    (tmp_path / 'web.lock').write_text('web v2')
+    main(args)
+    assert mock_upload_prepared_spdx.call_count == 3
+    assert mock_resolve_image.call_args[0][2] == 'web'
+
+
+# Test ShardRing, LeaseLock and sharded batch execution
+class TestShardRing:
+    KEYS = [(f'product-{i % 40}', f'{i}.0') for i in range(2000)]
+
+    def test_shard_for_is_deterministic_and_balanced(self):
+        ring = ShardRing(4)
+        shards = [ring.shard_for(*key) for key in self.KEYS]
+
+        assert shards == [ShardRing(4).shard_for(*key) for key in self.KEYS[:50]] + shards[50:]
+        assert all(250 < shards.count(shard) < 750 for shard in range(4))
+
+    def test_adding_a_node_moves_few_keys(self):
+        before = ShardRing(4)
+        after = ShardRing(5)
+
+        moved = sum(1 for key in self.KEYS if before.shard_for(*key) != after.shard_for(*key))
+
+        assert moved < len(self.KEYS) * 0.35
+
+    def test_select_partitions_jobs(self):
+        jobs = [BatchJob(product, release, IMAGE_NAME, SPDX_FILE_PATH, HOST) for product, release in self.KEYS[:100]]
+        ring = ShardRing(3)
+
+        selected = [ring.select(jobs, shard) for shard in range(3)]
+
+        assert sorted(map(id, sum(selected, []))) == sorted(map(id, jobs))
+
+
+def test_batch_sharding_requires_lock_dir(tmp_path):
+    manifest = tmp_path / 'manifest.json'
+    manifest.write_text('[]')
+
+    with mock.patch.object(SpdxBatchPipeline, 'run') as mock_run, pytest.raises(SystemExit):
+        main(['batch', str(manifest), '--shard-index', '0', '--shard-count', '2'])
+
+    mock_run.assert_not_called()
+
+
+class TestLeaseLock:
+    def test_mutual_exclusion(self, tmp_path):
+        holders = []
+        overlaps = []
+
+        def worker():
+            for _ in range(5):
+                with LeaseLock(str(tmp_path), 'host/product/p', poll_interval=0.001):
+                    holders.append(1)
+                    if len(holders) > 1:
+                        overlaps.append(1)
+                    time.sleep(0.001)
+                    holders.pop()
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert overlaps == []
+        assert [name for name in os.listdir(tmp_path)] == []
+
+    def test_stale_lease_is_broken(self, tmp_path):
+        # a crashed node leaves its lease behind, with no heartbeat
+        assert LeaseLock(str(tmp_path), 'host/product/p')._try_create()
+
+        with LeaseLock(str(tmp_path), 'host/product/p', ttl=0.1, timeout=2, poll_interval=0.01) as lease:
+            assert lease._read_token(lease.path) == lease.token
+
+    def test_heartbeat_keeps_lease_held(self, tmp_path):
+        # an mtime far in the future or past says nothing: only a lease that stops changing is stale
+        with LeaseLock(str(tmp_path), 'host/product/p', ttl=0.2) as held:
+            os.utime(held.path, (time.time() - 1000, time.time() - 1000))
+            with pytest.raises(CoronaError, match='Timed out waiting for lease'):
+                LeaseLock(str(tmp_path), 'host/product/p', ttl=0.2, timeout=1, poll_interval=0.01).acquire()
+            assert held._read_token(held.path) == held.token
+
+        assert os.listdir(tmp_path) == []
+
+    def test_timeout(self, tmp_path):
+        held = LeaseLock(str(tmp_path), 'host/product/p')
+        held.acquire()
+
+        with pytest.raises(CoronaError, match='Timed out waiting for lease'):
+            LeaseLock(str(tmp_path), 'host/product/p', timeout=0.05, poll_interval=0.01).acquire()
+
+        held.release()
+        assert os.listdir(tmp_path) == []
+
+
+@mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='test_token')
+@mock.patch.object(ProductManager, 'get_or_create_product', return_value=PRODUCT_ID)
+@mock.patch.object(ReleaseManager, 'get_or_create_release', return_value=RELEASE_ID)
+@mock.patch.object(ImageManager, 'get_or_create_image', return_value=IMAGE_ID)
+@mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+def test_batch_pipeline_with_lock_dir(mock_upload_prepared_spdx, mock_get_or_create_image, 
+                                      mock_get_or_create_release, mock_get_or_create_product, mock_get_auth_token, tmp_path):
+    lock_dir = tmp_path / 'locks'
+    jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, f'image-{i}', _write_spdx(tmp_path / f'{i}.json'), HOST) for i in range(3)]
+
+    results = SpdxBatchPipeline(cpu_workers=1, io_workers=2, lock_dir=str(lock_dir)).run(jobs)
+
+    assert [result['image_id'] for result in results] == [IMAGE_ID] * 3
+    assert mock_get_or_create_product.call_count == 3
+    assert mock_upload_prepared_spdx.call_count == 3
+    assert os.listdir(lock_dir) == []
+
+
+# Test UploadScheduler and size-ordered batch uploads
+class TestUploadScheduler:
+    def test_get_largest_first(self):
+        scheduler = UploadScheduler(capacity=10, large_threshold=1000)
+        for name, size in (('small', 10), ('big', 500), ('medium', 100)):
+            scheduler.put(name, HOST, size)
+
+        assert [scheduler.get()[0] for _ in range(3)] == ['big', 'medium', 'small']
+
+    def test_large_uploads_capped_per_host_small_fill_in(self):
+        scheduler = UploadScheduler(capacity=10, large_threshold=100, max_large_per_host=1)
+        scheduler.put('large-1', HOST, 300)
+        scheduler.put('large-2', HOST, 200)
+        scheduler.put('other-host-large', 'other.example.com', 250)
+        scheduler.put('small', HOST, 10)
+
+        assert scheduler.get() == ('large-1', HOST, 300)
+        assert scheduler.get() == ('other-host-large', 'other.example.com', 250)
+        assert scheduler.get() == ('small', HOST, 10)
+
+        scheduler.done(HOST, 300)
+        assert scheduler.get() == ('large-2', HOST, 200)
+
+    def test_bytes_in_flight_cap(self):
+        scheduler = UploadScheduler(capacity=10, max_bytes_in_flight=100)
+        scheduler.put('a', HOST, 150)
+        scheduler.put('b', HOST, 60)
+        scheduler.put('c', HOST, 30)
+
+        # a single upload over the cap still runs when nothing else is in flight
+        assert scheduler.get()[0] == 'a'
+        scheduler.done(HOST, 150)
+        assert scheduler.get()[0] == 'b'
+        assert scheduler.get()[0] == 'c'
+
+    def test_put_blocks_at_capacity_and_close_drains(self):
+        scheduler = UploadScheduler(capacity=1)
+        scheduler.put('a', HOST, 1)
+        put_done = threading.Event()
+        putter = threading.Thread(target=lambda: (scheduler.put('b', HOST, 2), put_done.set()))
+        putter.start()
+
+        assert not put_done.wait(0.05)
+        assert scheduler.get()[0] == 'a'
+        assert put_done.wait(1)
+        putter.join()
+        scheduler.close()
+        assert scheduler.get()[0] == 'b'
+        assert scheduler.get() is None
+
+
+@mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+def test_batch_pipeline_uploads_largest_first(mock_resolve_image, tmp_path):
+    jobs = [BatchJob(PRODUCT_NAME, RELEASE_VERSION, f'image-{packages}', _write_spdx(tmp_path / f'{packages}.json', packages), HOST) 
+            for packages in (1, 50, 5, 20)]
+    uploaded = []
+
+    with mock.patch.object(SpdxManager, 'upload_prepared_spdx', 
+                           side_effect=lambda image_id, prepared: uploaded.append(prepared.file_name)):
+        SpdxBatchPipeline(cpu_workers=1, io_workers=1, queue_size=4).run(jobs)
+
+    assert uploaded == ['50.json', '20.json', '5.json', '1.json']
+
+
+# Test CoronaUploader session sharing and the overlapped single upload in main()
+class TestCoronaUploader:
+    def test_managers_share_session_and_token(self):
+        uploader = CoronaUploader(HOST, USERNAME, PAT)
+        managers = [uploader.product_manager, uploader.release_manager, uploader.image_manager, uploader.spdx_manager]
+
+        with mock.patch.object(uploader.session, 'post', return_value=mock.Mock(json=lambda: {'token': 'test_token'})) as mock_post:
+            uploader.sign_in()
+            uploader.sign_in()
+
+        assert mock_post.call_count == 1
+        assert all(manager.session is uploader.session for manager in managers)
+        assert all(manager.token == 'test_token' for manager in managers)
+
+    @mock.patch.object(CoronaUploader, 'sign_in')
+    @mock.patch.object(ProductManager, 'get_or_create_product', return_value=PRODUCT_ID)
+    @mock.patch.object(ReleaseManager, 'get_or_create_release', return_value=RELEASE_ID)
+    @mock.patch.object(ImageManager, 'get_or_create_image', return_value=IMAGE_ID)
+    def test_resolve_image(self, mock_get_or_create_image, mock_get_or_create_release, mock_get_or_create_product, mock_sign_in):
+        image_id = CoronaUploader(HOST, USERNAME, PAT).resolve_image(PRODUCT_NAME, RELEASE_VERSION, IMAGE_NAME)
+
+        assert image_id == IMAGE_ID
+        mock_sign_in.assert_called_once()
+        mock_get_or_create_release.assert_called_once_with(PRODUCT_ID, RELEASE_VERSION)
+        mock_get_or_create_image.assert_called_once_with(PRODUCT_ID, RELEASE_ID, IMAGE_NAME)
+
+
+class TestMain:
+    @pytest.fixture
+    def spdx_env(self, tmp_path):
+        spdx_file = _write_spdx(tmp_path / 'test.spdx.json')
+        with mock.patch.dict(os.environ, {'CORONA_HOST': HOST, 'CORONA_SPDX_FILE_PATH': spdx_file, 'CORONA_TARGETS': ''}):
+            yield spdx_file
+
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_prepares_spdx_while_resolving_image(self, mock_upload_prepared_spdx, spdx_env):
+        from_file = PreparedSpdx.from_file
+        prepared = threading.Event()
+        overlapped = []
+
+        def fake_from_file(*args):
+            result = from_file(*args)
+            prepared.set()
+            return result
+
+        def fake_resolve_image(uploader, *args):
+            # the SPDX file is prepared while the product/release/image chain is still running
+            overlapped.append(prepared.wait(5))
+            return IMAGE_ID
+
+        with mock.patch.object(CoronaUploader, 'resolve_image', autospec=True, side_effect=fake_resolve_image), \
+             mock.patch.object(PreparedSpdx, 'from_file', side_effect=fake_from_file) as mock_from_file:
+            main([])
+
+        assert overlapped == [True]
+        mock_from_file.assert_called_once_with(spdx_env, False, True)
+        image_id, prepared_spdx = mock_upload_prepared_spdx.call_args[0]
+        assert image_id == IMAGE_ID
+        assert prepared_spdx.content == open(spdx_env, 'rb').read()
+
+    @mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_invalid_spdx_is_not_uploaded(self, mock_upload_prepared_spdx, mock_resolve_image, spdx_env):
+        with open(spdx_env, 'w') as f:
+            f.write('not json')
+
+        with pytest.raises(SystemExit):
+            main([])
+
+        mock_upload_prepared_spdx.assert_not_called()
+
+
+# Test CredentialPool and pooled make_authenticated_request
+class TestCredentialPool:
+    @pytest.fixture
+    def pool(self):
+        return CredentialPool([ServiceAccount('svc1', 'pat1'), ServiceAccount('svc2', 'pat2')], bench_seconds=60)
+
+    def test_acquire_least_loaded(self, pool):
+        first = pool.acquire()
+        second = pool.acquire()
+        assert {first.user_name, second.user_name} == {'svc1', 'svc2'}
+
+        pool.release(first)
+        assert pool.acquire() is first
+
+    def test_throttled_account_is_benched(self, pool):
+        first = pool.acquire()
+        pool.release(first, 'throttled')
+
+        assert first is pool.accounts[0]
+        assert first.benched_until > time.monotonic() + 50
+        assert [pool.acquire() for _ in range(3)] == [pool.accounts[1]] * 3
+
+    def test_bench_doubles_on_consecutive_failures_and_resets(self, pool):
+        account = pool.accounts[0]
+        account.in_flight = 3
+        pool.release(account, 'throttled')
+        pool.release(account, 'throttled')
+        assert account.benched_until > time.monotonic() + 110
+
+        account.token = 'token'
+        pool.release(account, 'unauthorized')
+        assert account.token is None
+        assert account.failures == 3
+
+        pool.release(account)
+        assert account.failures == 0
+
+    def test_acquire_waits_for_bench_to_expire(self):
+        pool = CredentialPool([ServiceAccount('svc1', 'pat1')], bench_seconds=0.05)
+        pool.release(pool.acquire(), 'throttled')
+
+        started = time.monotonic()
+        pool.acquire()
+        assert time.monotonic() - started >= 0.04
+
+    def test_max_in_flight(self):
+        pool = CredentialPool([ServiceAccount('svc1', 'pat1', max_in_flight=1), ServiceAccount('svc2', 'pat2')])
+        pool.accounts[1].requests = 100
+
+        assert [pool.acquire().user_name for _ in range(3)] == ['svc1', 'svc2', 'svc2']
+
+    def test_from_file_filters_by_host(self, tmp_path):
+        credentials_file = tmp_path / 'credentials.json'
+        credentials_file.write_text(json.dumps([
+            {'username': 'svc1', 'pat': 'pat1'},
+            {'username': 'svc2', 'pat': 'pat2', 'host': HOST, 'max_in_flight': 4},
+            {'username': 'svc3', 'pat': 'pat3', 'host': 'other.example.com'},
+        ]))
+
+        pool = CredentialPool.from_file(str(credentials_file), HOST)
+
+        assert [account.user_name for account in pool.accounts] == ['svc1', 'svc2']
+        assert pool.accounts[1].max_in_flight == 4
+
+    def test_from_config_not_configured(self):
+        with mock.patch.dict(os.environ, {'CORONA_CREDENTIALS_FILE': ''}):
+            assert CredentialPool.from_config(HOST) is None
+
+
+class TestPooledRequests:
+    @pytest.fixture
+    def api_client(self):
+        pool = CredentialPool([ServiceAccount('svc1', 'pat1'), ServiceAccount('svc2', 'pat2')], bench_seconds=60)
+        return CoronaAPIClient(HOST, USERNAME, credential_pool=pool)
+
+    @mock.patch.object(CoronaAPIClient, '_sign_in', side_effect=lambda user_name, pat: f'token-{user_name}')
+    @mock.patch('requests.request')
+    @mock.patch('time.sleep')
+    def test_throttled_account_retries_with_another(self, mock_sleep, mock_request, mock_sign_in, api_client):
+        tokens = []
+
+        def fake_request(method, url, headers, **kwargs):
+            tokens.append(headers['Authorization'])
+            if len(tokens) == 1:
+                return mock.Mock(status_code=429, raise_for_status=mock.Mock(side_effect=requests.exceptions.HTTPError()))
+            return mock.Mock(status_code=200, json=lambda: {'data': 'response_data'})
+
+        mock_request.side_effect = fake_request
+
+        assert api_client.make_authenticated_request('GET', 'endpoint') == {'data': 'response_data'}
+        assert tokens == ['Bearer token-svc1', 'Bearer token-svc2']
+        mock_sleep.assert_not_called()
+        assert api_client.credential_pool.accounts[0].benched_until > time.monotonic()
+        assert api_client.throttled_requests == 1
+
+    @mock.patch.object(CoronaAPIClient, '_sign_in', side_effect=lambda user_name, pat: f'token-{user_name}')
+    @mock.patch('requests.request')
+    def test_unauthorized_account_is_benched(self, mock_request, mock_sign_in, api_client):
+        mock_request.side_effect = [
+            mock.Mock(status_code=401, raise_for_status=mock.Mock(side_effect=requests.exceptions.HTTPError())),
+            mock.Mock(status_code=200, json=lambda: {'data': 'response_data'}),
+        ]
+
+        assert api_client.make_authenticated_request('GET', 'endpoint') == {'data': 'response_data'}
+        unauthorized = api_client.credential_pool.accounts[0]
+        assert unauthorized.token is None
+        assert unauthorized.benched_until > time.monotonic()
+
+    @mock.patch('requests.request')
+    def test_sign_in_failure_is_benched(self, mock_request, api_client):
+        mock_request.return_value = mock.Mock(status_code=200, json=lambda: {'data': 'response_data'})
+
+        def fake_sign_in(user_name, pat):
+            if user_name == 'svc1':
+                raise CoronaError('Error obtaining auth token')
+            return 'token-svc2'
+
+        with mock.patch.object(CoronaAPIClient, '_sign_in', side_effect=fake_sign_in):
+            assert api_client.make_authenticated_request('GET', 'endpoint') == {'data': 'response_data'}
+
+        assert mock_request.call_args[1]['headers']['Authorization'] == 'Bearer token-svc2'
+        assert all(account.in_flight == 0 for account in api_client.credential_pool.accounts)
+
+
+# Test the tag-value and CycloneDX input adapters and the streamed upload
+TAG_VALUE_SPDX = '''SPDXVersion: SPDX-2.3
+DataLicense: CC0-1.0
+SPDXID: SPDXRef-DOCUMENT
+DocumentName: image
+DocumentNamespace: https://example.com/image
+Creator: Tool: syft-1.0
+Created: 2024-01-01T00:00:00Z
+
+PackageName: openssl
+SPDXID: SPDXRef-openssl
+PackageVersion: 3.0.2
+PackageDownloadLocation: NOASSERTION
+FilesAnalyzed: false
+PackageLicenseDeclared: Apache-2.0
+PackageCopyrightText: <text>Copyright
+The OpenSSL Project</text>
+ExternalRef: PACKAGE_MANAGER purl pkg:deb/ubuntu/openssl@3.0.2
+
+FileName: ./usr/lib/libssl.so
+SPDXID: SPDXRef-libssl
+FileChecksum: SHA1: 85ed0817af83a24ad8da68c2b5094de69833983c
+LicenseConcluded: NOASSERTION
+
+Relationship: SPDXRef-DOCUMENT DESCRIBES SPDXRef-openssl
+Relationship: SPDXRef-openssl CONTAINS SPDXRef-libssl
+RelationshipComment: shared library
+
+PackageName: zlib
+SPDXID: SPDXRef-zlib
+PackageVersion: 1.2.11
+'''
+
+CYCLONEDX_BOM = {
+    'bomFormat': 'CycloneDX',
+    'specVersion': '1.4',
+    'serialNumber': 'urn:uuid:3e671687-395b-41f5-a30f-a58921a69b79',
+    'metadata': {
+        'timestamp': '2024-01-01T00:00:00Z',
+        'tools': [{'name': 'syft', 'version': '1.0'}],
+        'component': {'bom-ref': 'image', 'type': 'container', 'name': 'image'},
+    },
+    'components': [
+        {'bom-ref': 'pkg:deb/ubuntu/openssl@3.0.2', 'type': 'library', 'name': 'openssl', 'version': '3.0.2', 
+         'purl': 'pkg:deb/ubuntu/openssl@3.0.2', 'licenses': [{'license': {'id': 'Apache-2.0'}}], 
+         'hashes': [{'alg': 'SHA-256', 'content': 'ab' * 32}], 
+         'components': [{'bom-ref': 'libssl', 'type': 'file', 'name': 'libssl.so'}]},
+        {'bom-ref': 'pkg:deb/ubuntu/zlib@1.2.11', 'type': 'library', 'name': 'zlib', 'version': '1.2.11', 
+         'licenses': [{'expression': 'Zlib OR MIT'}, {'license': {'id': 'BSD-3-Clause'}}]},
+    ],
+    'dependencies': [
+        {'ref': 'image', 'dependsOn': ['pkg:deb/ubuntu/openssl@3.0.2']},
+        {'ref': 'pkg:deb/ubuntu/openssl@3.0.2', 'dependsOn': ['pkg:deb/ubuntu/zlib@1.2.11']},
+    ],
+}
+
+
+class TestTagValueSpdxConverter:
+    def test_converts_to_spdx_json(self, tmp_path):
+        spdx_file = tmp_path / 'image.spdx'
+        spdx_file.write_text(TAG_VALUE_SPDX)
+
+        spdx = json.loads(''.join(TagValueSpdxConverter(str(spdx_file)).iter_json()))
+
+        assert spdx['spdxVersion'] == 'SPDX-2.3'
+        assert spdx['name'] == 'image'
+        assert spdx['creationInfo'] == {'creators': ['Tool: syft-1.0'], 'created': '2024-01-01T00:00:00Z'}
+        assert [package['name'] for package in spdx['packages']] == ['openssl', 'zlib']
+        openssl = spdx['packages'][0]
+        assert openssl['filesAnalyzed'] is False
+        assert openssl['copyrightText'] == 'Copyright\nThe OpenSSL Project'
+        assert openssl['externalRefs'] == [{'referenceCategory': 'PACKAGE-MANAGER', 'referenceType': 'purl', 
+                                            'referenceLocator': 'pkg:deb/ubuntu/openssl@3.0.2'}]
+        assert spdx['files'] == [{'fileName': './usr/lib/libssl.so', 'SPDXID': 'SPDXRef-libssl', 'licenseConcluded': 'NOASSERTION', 
+                                  'checksums': [{'algorithm': 'SHA1', 'checksumValue': '85ed0817af83a24ad8da68c2b5094de69833983c'}]}]
+        assert spdx['relationships'] == [
+            {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 'relatedSpdxElement': 'SPDXRef-openssl'},
+            {'spdxElementId': 'SPDXRef-openssl', 'relationshipType': 'CONTAINS', 'relatedSpdxElement': 'SPDXRef-libssl', 
+             'comment': 'shared library'},
+        ]
+
+    def test_document_without_elements(self, tmp_path):
+        spdx_file = tmp_path / 'empty.spdx'
+        spdx_file.write_text('SPDXVersion: SPDX-2.3\nDocumentName: empty\n')
+
+        spdx = json.loads(''.join(TagValueSpdxConverter(str(spdx_file)).iter_json()))
+
+        assert spdx == {'spdxVersion': 'SPDX-2.3', 'name': 'empty', 'packages': [], 'files': [], 'relationships': []}
+
+
+class TestCycloneDxSpdxConverter:
+    @pytest.fixture
+    def bom_file(self, tmp_path):
+        bom_file = tmp_path / 'image.cdx.json'
+        bom_file.write_text(json.dumps(CYCLONEDX_BOM, indent=2))
+        return str(bom_file)
+
+    def test_converts_to_spdx_json(self, bom_file):
+        spdx = json.loads(''.join(CycloneDxSpdxConverter(bom_file).iter_json()))
+        spdx_id = CycloneDxSpdxConverter.spdx_id
+
+        assert spdx['name'] == 'image'
+        assert spdx['documentNamespace'].endswith('-3e671687-395b-41f5-a30f-a58921a69b79')
+        assert spdx['creationInfo']['creators'][0] == 'Tool: syft-1.0'
+        assert [package['name'] for package in spdx['packages']] == ['image', 'openssl', 'libssl.so', 'zlib']
+        openssl = spdx['packages'][1]
+        assert openssl['SPDXID'] == spdx_id('pkg:deb/ubuntu/openssl@3.0.2')
+        assert openssl['licenseDeclared'] == 'Apache-2.0'
+        assert openssl['checksums'] == [{'algorithm': 'SHA256', 'checksumValue': 'ab' * 32}]
+        assert openssl['externalRefs'][0]['referenceLocator'] == 'pkg:deb/ubuntu/openssl@3.0.2'
+        assert spdx['packages'][3]['licenseDeclared'] == '(Zlib OR MIT) AND BSD-3-Clause'
+        assert spdx['relationships'] == [
+            {'spdxElementId': 'SPDXRef-DOCUMENT', 'relationshipType': 'DESCRIBES', 'relatedSpdxElement': spdx_id('image')},
+            {'spdxElementId': openssl['SPDXID'], 'relationshipType': 'CONTAINS', 'relatedSpdxElement': spdx_id('libssl')},
+            {'spdxElementId': spdx_id('image'), 'relationshipType': 'DEPENDS_ON', 'relatedSpdxElement': openssl['SPDXID']},
+            {'spdxElementId': openssl['SPDXID'], 'relationshipType': 'DEPENDS_ON', 
+             'relatedSpdxElement': spdx_id('pkg:deb/ubuntu/zlib@1.2.11')},
+        ]
+
+    def test_spdx_ids_are_valid_and_distinct(self):
+        first = CycloneDxSpdxConverter.spdx_id('pkg:npm/a@1.0?x=1')
+        assert re.fullmatch(r'SPDXRef-[A-Za-z0-9.-]+', first)
+        assert first != CycloneDxSpdxConverter.spdx_id('pkg:npm/a@1.0?x=2')
+
+
+def test_converters_write_no_temporary_files(tmp_path):
+    spdx_file = tmp_path / 'image.spdx'
+    spdx_file.write_text(TAG_VALUE_SPDX)
+    bom_file = tmp_path / 'image.cdx.json'
+    bom_file.write_text(json.dumps(CYCLONEDX_BOM))
+
+    with mock.patch('tempfile.SpooledTemporaryFile', side_effect=AssertionError('spooled')), \
+         mock.patch('tempfile.TemporaryFile', side_effect=AssertionError('spooled')), \
+         mock.patch('tempfile.mkstemp', side_effect=AssertionError('spooled')):
+        tag_value = json.loads(''.join(TagValueSpdxConverter(str(spdx_file)).iter_json()))
+        cyclonedx = json.loads(''.join(CycloneDxSpdxConverter(str(bom_file)).iter_json()))
+
+    assert len(tag_value['files']) == 1 and len(tag_value['relationships']) == 2
+    assert len(cyclonedx['relationships']) == 4
+    assert sorted(os.listdir(tmp_path)) == ['image.cdx.json', 'image.spdx']
+
+
+def test_json_stream_reader_small_chunks():
+    document = {'a': [1, 2.5, -30, True, None, 'x' * 10], 'b': {'c': [], 'd': {}}, 'e': 12345678}
+    reader = _JsonStreamReader(io.StringIO(json.dumps(document)), chunk_size=3)
+    seen = {}
+
+    for key in reader.iter_object():
+        if key == 'a':
+            seen[key] = [reader.read_value() for _ in reader.iter_array()]
+        elif key == 'b':
+            reader.skip_value()
+        else:
+            seen[key] = reader.read_value()
+
+    assert seen == {'a': document['a'], 'e': 12345678}
+
+
+def test_detect_input_format(tmp_path):
+    tag_value = tmp_path / 'image.txt'
+    tag_value.write_text(TAG_VALUE_SPDX)
+    cyclonedx = tmp_path / 'image.json'
+    cyclonedx.write_text(json.dumps(CYCLONEDX_BOM))
+    spdx_json = _write_spdx(tmp_path / 'image.spdx.json')
+
+    assert detect_input_format(str(tmp_path / 'other.spdx')) == 'spdx-tv'
+    assert detect_input_format(str(tag_value)) == 'spdx-tv'
+    assert detect_input_format(str(cyclonedx)) == 'cyclonedx-json'
+    assert detect_input_format(spdx_json) == 'spdx-json'
+    assert spdx_json_stream(spdx_json) is None
+    with pytest.raises(CoronaError):
+        detect_input_format(str(tmp_path / 'missing.json'))
+
+
+@pytest.mark.parametrize('input_format', ['spdx-tv', 'cyclonedx-json'])
+def test_spdx_json_stream_rejects_wrong_format(input_format, tmp_path):
+    spdx_json = _write_spdx(tmp_path / 'image.spdx.json')
+
+    with pytest.raises(CoronaError, match='is not'):
+        spdx_json_stream(spdx_json, input_format)
+
+
+def test_tag_value_requires_spdx_version_header(tmp_path):
+    spdx_file = tmp_path / 'image.spdx'
+    spdx_file.write_text(TAG_VALUE_SPDX.replace('SPDXVersion: SPDX-2.3\n', '') + 'SPDXVersion: SPDX-2.3\n')
+
+    with pytest.raises(CoronaError, match='no SPDXVersion'):
+        ''.join(TagValueSpdxConverter(str(spdx_file)).iter_json())
+
+
+def test_spdx_json_stream_conversion_error(tmp_path):
+    bom_file = tmp_path / 'broken.json'
+    bom_file.write_text('{"bomFormat": "CycloneDX", "components": [{"name": ')
+
+    with pytest.raises(CoronaError, match='Unable to convert'):
+        spdx_json_stream(str(bom_file))
+
+
+def test_spdx_json_stream_error_while_streaming(tmp_path):
+    bom_file = tmp_path / 'odd.json'
+    bom_file.write_text('{"bomFormat": "CycloneDX", "components": [{"name": "a", "hashes": "not a list"}]}')
+
+    chunks = spdx_json_stream(str(bom_file))
+
+    with pytest.raises(CoronaError, match='Unable to convert'):
+        ''.join(chunks())
+
+
+class TestUploadSpdxStream:
+    @mock.patch.object(CoronaAPIClient, 'get_auth_token', return_value='token')
+    @mock.patch('requests.request')
+    def test_streams_multipart_body(self, mock_request, mock_get_auth_token):
+        bodies = []
+
+        def fake_request(method, url, headers, data=None, **kwargs):
+            bodies.append((headers['Content-Type'], b''.join(data)))
+            if len(bodies) == 1:
+                return mock.Mock(status_code=503, raise_for_status=mock.Mock(side_effect=requests.exceptions.HTTPError()))
+            return mock.Mock(status_code=200, json=lambda: {'status': 'success'})
+
+        mock_request.side_effect = fake_request
+        spdx_manager = SpdxManager(HOST, USERNAME)
+
+        with mock.patch('time.sleep'):
+            response = spdx_manager.upload_spdx_stream(IMAGE_ID, 'image.spdx.json', lambda: iter(['{"name":', '"é"}']))
+
+        assert response == {'status': 'success'}
+        # the body is rebuilt from a fresh chunks() iterator on retry
+        assert len(bodies) == 2 and bodies[0] == bodies[1]
+        content_type, body = bodies[1]
+        boundary = content_type.split('boundary=')[1].encode()
+        assert content_type.startswith('multipart/form-data')
+        assert b'name="ignore_relationships"\r\n\r\ntrue\r\n' in body
+        assert b'filename="image.spdx.json"\r\nContent-Type: application/json\r\n\r\n{"name":"\xc3\xa9"}\r\n--' + boundary + b'--\r\n' in body
+
+    @mock.patch.object(CoronaUploader, 'resolve_image', return_value=IMAGE_ID)
+    @mock.patch.object(SpdxManager, 'upload_spdx_stream')
+    @mock.patch.object(SpdxManager, 'upload_prepared_spdx')
+    def test_main_streams_tag_value_input(self, mock_upload_prepared_spdx, mock_upload_spdx_stream, mock_resolve_image, tmp_path):
+        spdx_file = tmp_path / 'image.spdx'
+        spdx_file.write_text(TAG_VALUE_SPDX)
+
+        with mock.patch.dict(os.environ, {'CORONA_HOST': HOST, 'CORONA_SPDX_FILE_PATH': str(spdx_file), 'CORONA_TARGETS': ''}):
+            main([])
+
+        mock_upload_prepared_spdx.assert_not_called()
+        image_id, file_name, chunks = mock_upload_spdx_stream.call_args[0]
+        assert (image_id, file_name) == (IMAGE_ID, 'image.spdx.json')
+        assert [package['name'] for package in json.loads(''.join(chunks()))['packages']] == ['openssl', 'zlib']
+
+    @mock.patch.object(CoronaAPIClient, 'make_authenticated_request')
+    def test_main_rejects_forced_format_before_any_request(self, mock_make_authenticated_request, tmp_path):
+        spdx_file = _write_spdx(tmp_path / 'image.spdx.json')
+
+        with mock.patch.dict(os.environ, {'CORONA_HOST': HOST, 'CORONA_SPDX_FILE_PATH': spdx_file, 'CORONA_TARGETS': ''}), \
+             pytest.raises(SystemExit):
+            main(['--input-format', 'cyclonedx-json'])
+
+        mock_make_authenticated_request.assert_not_called()